@@ -1,6 +1,13 @@
+import argparse
+import glob
+import json
+import numpy as np
 import pandas as pd
-import re
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from openpyxl.utils import get_column_letter
+import instrument
+from itemstore import file_hash
 
 def get_image_name(condition_number, first_word, third_word):
     image_mapping = {
@@ -17,109 +24,237 @@ def get_image_name(condition_number, first_word, third_word):
     
     return image_mapping.get(condition_number, '')
 
-def transform_excel(input_file, output_file):
-    # Read the input Excel file
-    df = pd.read_excel(input_file)
+PRONOUNS = ['he', 'she', 'they', 'il', 'elle', 'iel']
+WORD_COLUMNS = ['FirstWord', 'SecWord', 'ThirdWord', 'FourthWord', 'FifthWord', 'SixthWord', 'SeventhWord', 'EighthWord']
+ALL_COLUMNS = [
+    'Item:', 'StimNum', 'StimType', 'Image', 'code1', 'FirstWord', 'code2', 'SecWord',
+    'code3', 'ThirdWord', 'code4', 'FourthWord', 'code5', 'FifthWord', 'code6', 'SixthWord',
+    'code7', 'SeventhWord', 'code8', 'EighthWord', 'Probe', 'Cresp'
+]
+
+def transform_frame(df, pairs=None):
+    """Convert a stimulus list DataFrame into AJT rows, column by column.
+
+    pairs, if given, maps item numbers to the list's scheduled character pairs (stimgen.item_pairs); plural rows
+    then take their Image from the scheduled pair instead of the first and third words.
+
+    Returns (output DataFrame, item numbers of stimuli with more than eight words, which were truncated).
+    """
+    df = df.reset_index(drop=True)
+    item_numbers = df['Item Number'].to_numpy()
+    conditions = df['Condition Number'].to_numpy()
+    num_words = len(WORD_COLUMNS)
+
+    # Tokenize every stimulus at once into long (row, position) form
+    tokens = df['Stimulus'].astype(str).str.strip().str.extractall(r'(\b\w+\b)')[0]
+    rows = tokens.index.get_level_values(0).to_numpy(dtype=np.int64)
+    positions = tokens.index.get_level_values('match').to_numpy(dtype=np.int64)
+    token_counts = np.bincount(rows, minlength=len(df))
+    kept = positions < num_words
+
+    words = np.full((len(df), num_words), '', dtype=object)
+    words[rows[kept], positions[kept]] = tokens.to_numpy()[kept]
+    is_pronoun = np.zeros((len(df), num_words), dtype=bool)
+    is_pronoun[rows[kept], positions[kept]] = tokens.str.lower().isin(PRONOUNS).to_numpy()[kept]
+
+    # Image is looked up per distinct (condition, first word, third word) rather than per row
+    first_words, third_words = words[:, 0], words[:, 2]
+    if pairs is not None:
+        # Matched by item number, so rows dropped by stimgen (e.g. missing translations) do not shift the schedule
+        scheduled = [pairs.get(int(item)) for item in item_numbers]
+        first_words = np.array([pair[0] if pair else w for pair, w in zip(scheduled, first_words)], dtype=object)
+        third_words = np.array([pair[1] if pair else w for pair, w in zip(scheduled, third_words)], dtype=object)
+    keys = pd.DataFrame({'condition': conditions, 'first': first_words, 'third': third_words})
+    image_table = keys.drop_duplicates().copy()
+    image_table['Image'] = [get_image_name(c, f, t) for c, f, t in image_table.itertuples(index=False)]
+    images = keys.merge(image_table, on=['condition', 'first', 'third'], how='left')['Image'].to_numpy()
+
+    # Code only the first pronoun in each sentence
+    codes = np.zeros(is_pronoun.shape, dtype=np.int64)
+    coded = np.flatnonzero(is_pronoun.any(axis=1))
+    codes[coded, is_pronoun[coded].argmax(axis=1)] = item_numbers[coded] + 10
 
-    # Create a list to store the output rows
-    output_rows = []
+    # The last word carries the sentence's period; empty word columns are filled with 'x'
+    ends = np.flatnonzero((token_counts > 0) & (token_counts <= num_words))
+    words[ends, token_counts[ends] - 1] = words[ends, token_counts[ends] - 1] + '.'
+    words[words == ''] = 'x'
 
-    # Process each row in the input DataFrame
-    for _, row in df.iterrows():
-        item_number = row['Item Number']
-        condition_number = row['Condition Number']
-        stimulus = row['Stimulus'].strip()  # Remove leading/trailing whitespace
+    output_df = pd.DataFrame({'Item:': item_numbers, 'StimNum': item_numbers, 'StimType': conditions, 'Image': images})
+    for i, word_column in enumerate(WORD_COLUMNS):
+        output_df[f'code{i+1}'] = codes[:, i]
+        output_df[word_column] = words[:, i]
+    output_df['Probe'] = '???'
+    output_df['Cresp'] = np.where(conditions % 2 == 0, 1, 5)
 
-        # Split the stimulus into words
-        words = re.findall(r'\b\w+\b', stimulus)
+    truncated = item_numbers[token_counts > num_words].tolist()
+    return output_df[ALL_COLUMNS].fillna(''), truncated
 
-        # Add period to the last word if it's missing
-        if not stimulus.endswith('.'):
+def records_frame(records):
+    """Build AJT rows directly from structured stimulus records (see stimgen.StimulusRecord).
+
+    Returns (output DataFrame, item numbers of stimuli with more than eight words, which were truncated).
+    """
+    num_words = len(WORD_COLUMNS)
+    rows = []
+    truncated = []
+    for record in records:
+        if len(record.tokens) > num_words:
+            truncated.append(record.item_num)
+        words = list(record.tokens[:num_words])
+        if len(record.tokens) <= num_words:
             words[-1] += '.'
-        elif words[-1].endswith('.'):
-            # If the last word already has a period, remove it temporarily
-            words[-1] = words[-1][:-1]
-
-        # Get image name
-        image_name = get_image_name(condition_number, words[0] if words else '', words[2] if len(words) > 2 else '')
-
-        # Create a new row for the output DataFrame
-        new_row = {
-            'Item:': item_number,
-            'StimNum': item_number,
-            'StimType': condition_number,
-            'Image': image_name,
+        words += ['x'] * (num_words - len(words))
+        codes = [0] * num_words
+        if record.pronoun_index < num_words:
+            codes[record.pronoun_index] = record.item_num + 10
+
+        characters = record.characters
+        row = {
+            'Item:': record.item_num,
+            'StimNum': record.item_num,
+            'StimType': record.condition,
+            'Image': get_image_name(record.condition, characters[0], characters[-1]),
             'Probe': '???',
-            'Cresp': 1 if condition_number % 2 == 0 else 5  # Keep this as is
+            'Cresp': 1 if record.condition % 2 == 0 else 5
         }
+        for i, word_column in enumerate(WORD_COLUMNS):
+            row[f'code{i+1}'] = codes[i]
+            row[word_column] = words[i]
+        rows.append(row)
+    return pd.DataFrame(rows, columns=ALL_COLUMNS), truncated
 
-        # Process each word in the stimulus
-        pronoun_found = False
-        for i in range(8):  # Always process 8 word columns
-            word_column = f'{["First", "Sec", "Third", "Fourth", "Fifth", "Sixth", "Seventh", "Eighth"][i]}Word'
-            code_column = f'code{i+1}'
-
-            if i < len(words):
-                word = words[i]
-                if i == len(words) - 1:
-                    word += '.'  # Add period to the last word
-                new_row[word_column] = word
-                
-                # Apply code only before pronoun
-                if word.lower().rstrip('.') in ['he', 'she', 'they', 'il', 'elle', 'iel'] and not pronoun_found:
-                    new_row[code_column] = item_number + 10
-                    pronoun_found = True
-                else:
-                    new_row[code_column] = 0
-            else:
-                new_row[word_column] = 'x'  # Fill empty word columns with 'x'
-                new_row[code_column] = 0  # Fill empty code columns with 0
-
-        # Add the new row to the output rows list
-        output_rows.append(new_row)
-
-    # Create the output DataFrame from the list of rows
-    output_df = pd.DataFrame(output_rows)
-
-    # Ensure all columns are present, even if they weren't used
-    all_columns = [
-        'Item:', 'StimNum', 'StimType', 'Image', 'code1', 'FirstWord', 'code2', 'SecWord',
-        'code3', 'ThirdWord', 'code4', 'FourthWord', 'code5', 'FifthWord', 'code6', 'SixthWord',
-        'code7', 'SeventhWord', 'code8', 'EighthWord', 'Probe', 'Cresp'
-    ]
-    for col in all_columns:
-        if col not in output_df.columns:
-            output_df[col] = ''
-
-    # Reorder columns to match the desired output
-    output_df = output_df[all_columns]
-
-    # Fill empty cells with empty strings
-    output_df = output_df.fillna('')
-
+def write_ajt_excel(output_df, output_file):
     # Write the output DataFrame to an Excel file
-    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+    with instrument.stage('write_ajt_excel'), pd.ExcelWriter(output_file, engine='openpyxl') as writer:
         output_df.to_excel(writer, index=False)
         
         # Auto-adjust column widths
-        for column in output_df:
-            column_width = max(output_df[column].astype(str).map(len).max(), len(column))
-            col_idx = output_df.columns.get_loc(column)
-            writer.sheets['Sheet1'].column_dimensions[chr(65 + col_idx)].width = column_width
-
-def process_all_files():
-    input_files = [
-        'stimuli_list_CQ.xlsx', 
-    ]
-    
+        widths = output_df.astype(str).apply(lambda column: column.str.len().max())
+        for col_idx, column in enumerate(output_df.columns):
+            column_width = max(widths[column] if len(output_df) else 0, len(column))
+            writer.sheets['Sheet1'].column_dimensions[get_column_letter(col_idx + 1)].width = column_width
+    instrument.count('ajt_rows', len(output_df))
+    instrument.count('excel_bytes_written', os.path.getsize(output_file))
+
+def report_truncated(truncated, source):
+    if truncated:
+        print(f"Warning: {len(truncated)} stimuli in {source} have more than {len(WORD_COLUMNS)} words "
+              f"and were truncated (items {truncated})")
+
+def write_ajt_file(records, output_file):
+    """Write an AJT workbook from stimulus records without going through a stimulus list workbook."""
+    with instrument.stage('records_frame'):
+        output_df, truncated = records_frame(records)
+    report_truncated(truncated, output_file)
+    write_ajt_excel(output_df, output_file)
+
+def transform_excel(input_file, output_file, pairs=None):
+    # Read the input Excel file
+    with instrument.stage('read_excel'):
+        df = pd.read_excel(input_file)
+
+    with instrument.stage('transform_frame'):
+        output_df, truncated = transform_frame(df, pairs)
+    report_truncated(truncated, input_file)
+    write_ajt_excel(output_df, output_file)
+
+def list_name(input_file):
+    # Correctly extract the file identifier (A1, A2, B1, etc.)
+    return os.path.basename(input_file).split('_')[-1].split('.')[0]
+
+def output_name(input_file):
+    return os.path.join(os.path.dirname(input_file), f"AJT{list_name(input_file)}.xlsx")  # e.g., AJTA1.xlsx
+
+def schedule_pairs(assignment_file, list_num, seed):
+    """Rebuild a list's character pair schedule from the assignment file and the seed stimgen was run with.
+
+    Returns {item number: pair} for transform_frame, or None when the list is not in the assignment file.
+    """
+    import stimgen  # stimgen imports this module for write_ajt_file, so import it only when a schedule is needed
+    assignments = pd.read_csv(assignment_file)
+    if list_num not in assignments.columns:
+        return None
+    return stimgen.item_pairs(list_num, assignments['Item:'].tolist(), assignments[list_num].tolist(), seed)
+
+def load_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest, manifest_file):
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+def _convert(input_file, output_file, assignment_file=None, seed=None):
+    print(f"Processing {input_file}...")
+    pairs = schedule_pairs(assignment_file, list_name(input_file), seed) if assignment_file is not None else None
+    transform_excel(input_file, output_file, pairs)
+    print(f"Completed. Output saved as {output_file}")
+    return output_file, instrument.collect()
+
+def process_all_files(patterns=('stimuli_list_*.xlsx',), processes=None, manifest_file='ajt_manifest.json', force=False,
+                      assignment_file=None, seed=None):
+    """Convert every matching stimulus list concurrently, skipping inputs unchanged since the last run.
+
+    The manifest maps each input file to the SHA-256 of its contents when it was last converted. An input is
+    rebuilt only when its hash differs or its AJT output is missing.
+
+    With assignment_file and the seed the lists were generated with, plural rows take their Image from the
+    character pair schedule (see schedule_pairs); the manifest then also records the assignment hash and seed.
+    """
+    input_files = sorted({f for pattern in patterns for f in glob.glob(pattern)})
+    manifest = load_manifest(manifest_file)
+
+    with instrument.stage('hash_inputs'):
+        hashes = {input_file: file_hash(input_file) for input_file in input_files}
+        schedule = [file_hash(assignment_file), seed] if assignment_file is not None else None
+    stale = [f for f in input_files
+             if force or manifest.get(f, {}).get('sha256') != hashes[f] or manifest.get(f, {}).get('schedule') != schedule
+             or not os.path.exists(output_name(f))]
     for input_file in input_files:
-        # Correctly extract the file identifier (A1, A2, B1, etc.)
-        file_id = input_file.split('_')[-1].split('.')[0]
-        output_file = f"AJT{file_id}.xlsx"  # e.g., AJTA1.xlsx
-        print(f"Processing {input_file}...")
-        transform_excel(input_file, output_file)
-        print(f"Completed. Output saved as {output_file}")
+        if input_file not in stale:
+            print(f"Skipping {input_file} (unchanged)")
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {executor.submit(_convert, f, output_name(f), assignment_file, seed): f for f in stale}
+            for future in as_completed(futures):
+                input_file = futures[future]
+                try:
+                    output_file, profile = future.result()
+                    instrument.merge(profile)
+                except Exception as e:
+                    print(f"Error processing {input_file}: {e}")
+                    continue
+                manifest[input_file] = {'sha256': hashes[input_file], 'output': output_file, 'schedule': schedule}
+
+    save_manifest(manifest, manifest_file)
+    print(f"Converted {len(stale)} of {len(input_files)} files")
 
 # Usage
 if __name__ == "__main__":
-    process_all_files()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Convert stimulus lists into AJT files.")
+    parser.add_argument('patterns', nargs='*', default=['stimuli_list_*.xlsx'],
+                        help="input files or glob patterns (default: stimuli_list_*.xlsx)")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--manifest', default='ajt_manifest.json', help="content-hash manifest file")
+    parser.add_argument('--force', action='store_true', help="rebuild every file regardless of the manifest")
+    parser.add_argument('--assignment', default=None,
+                        help="assignment file the lists were generated from; with --seed, plural images come from "
+                             "the character pair schedule instead of the stimulus words")
+    parser.add_argument('--seed', type=int, default=None, help="master seed stimgen was run with")
+    parser.add_argument('--profile', default=None,
+                        help="record stage timings and counters and write them to this JSON/Chrome trace file")
+    args = parser.parse_args()
+    if (args.assignment is None) != (args.seed is None):
+        parser.error("--assignment and --seed go together")
+    if args.profile:
+        instrument.enable()
+
+    process_all_files(args.patterns, processes=args.processes, manifest_file=args.manifest, force=args.force,
+                      assignment_file=args.assignment, seed=args.seed)
+    if args.profile:
+        instrument.write_profile(args.profile)
@@ -0,0 +1,125 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+NUM_CONDITIONS = 16
+# stimgen renders conditions 1-8 in French and 9-16 in English
+LANGUAGE_BLOCKS = (tuple(range(1, 9)), tuple(range(9, 17)))
+
+def condition_blocks(conditions=NUM_CONDITIONS, blocks=None):
+    """Return the condition blocks as a (blocks, conditions per block) array; one block unless blocks is given."""
+    if blocks is None:
+        if isinstance(conditions, int):
+            conditions = range(1, conditions + 1)
+        blocks = [tuple(conditions)]
+    sizes = {len(block) for block in blocks}
+    if len(sizes) != 1 or 0 in sizes:
+        raise ValueError(f"Condition blocks must be non-empty and the same size, got sizes {[len(b) for b in blocks]}")
+    return np.array(blocks, dtype=np.int64)
+
+def latin_square(num_items, num_lists, conditions=NUM_CONDITIONS, blocks=None, shift=0):
+    """Build an (items, lists) matrix of conditions that rotates every item through the conditions across lists.
+
+    Item i in list l gets condition (i + shift + offset_l) mod C, with the list offsets spread evenly over the C
+    conditions, so each list uses every condition equally often and an item never repeats a condition until
+    there are more lists than conditions.
+
+    With blocks (e.g. LANGUAGE_BLOCKS), items are split into one contiguous block per condition block and each
+    list maps item blocks to condition blocks in turn, so a list presents its items blocked by language while
+    every item still rotates through all blocks across lists.
+    """
+    table = condition_blocks(conditions, blocks)
+    num_blocks, block_size = table.shape
+    items = np.arange(num_items)
+    lists = np.arange(num_lists)
+
+    item_block = items * num_blocks // max(num_items, 1)
+    block_start = (np.arange(num_blocks) * num_items + num_blocks - 1) // num_blocks
+    within_block = items - block_start[item_block]
+
+    # Lists cycle through the block mappings; the lists sharing a mapping are spread evenly over the rotation
+    # offsets, by that mapping's own list count (with an odd number of lists the mappings differ by one)
+    mapping = lists % num_blocks
+    lists_per_mapping = np.bincount(mapping, minlength=num_blocks)
+    offsets = (lists // num_blocks) * block_size // np.maximum(lists_per_mapping[mapping], 1)
+    block = (item_block[:, None] + lists[None, :]) % num_blocks
+    position = (within_block[:, None] + shift + offsets[None, :]) % block_size
+    return table[block, position]
+
+def _counts(matrix, table, axis):
+    # Count conditions per list (axis=0) or per item (axis=1) as a (lists or items, blocks, per block) array
+    index = np.full(table.max() + 1, -1)
+    index[table.ravel()] = np.arange(table.size)
+    codes = index[matrix]
+    if (codes < 0).any():
+        raise ValueError("The matrix contains conditions outside the given blocks")
+    groups = matrix.shape[1 - axis]
+    group = np.arange(groups)[None, :] if axis == 0 else np.arange(groups)[:, None]
+    flat = np.bincount((codes + table.size * group).ravel(), minlength=groups * table.size)
+    return flat.reshape(groups, *table.shape)
+
+def _spread(counts):
+    return counts.max(axis=-1) - counts.min(axis=-1)
+
+def check_balance(matrix, conditions=NUM_CONDITIONS, blocks=None):
+    """Return a list of the balance properties the matrix violates (empty when it is balanced).
+
+    Checked per list: each block's conditions are used equally often (to within one) and the item blocks are
+    the same size. Checked per item: across lists it is seen in each block, and each condition within a block,
+    equally often (to within one).
+    """
+    table = condition_blocks(conditions, blocks)
+    matrix = np.asarray(matrix)
+    problems = []
+    if matrix.size == 0:
+        return problems
+
+    list_counts = _counts(matrix, table, axis=0)
+    item_counts = _counts(matrix, table, axis=1)
+    for name, counts in (('list', list_counts), ('item', item_counts)):
+        uneven_conditions = np.flatnonzero((_spread(counts) > 1).any(axis=1))
+        if uneven_conditions.size:
+            problems.append(f"{len(uneven_conditions)} {name}s use the conditions of a block unevenly "
+                            f"(first: {name} {uneven_conditions[0] + 1})")
+        uneven_blocks = np.flatnonzero(_spread(counts.sum(axis=2)) > 1)
+        if uneven_blocks.size:
+            problems.append(f"{len(uneven_blocks)} {name}s are spread unevenly over the condition blocks "
+                            f"(first: {name} {uneven_blocks[0] + 1})")
+    return problems
+
+def list_names(num_lists):
+    return [f"L{k}" for k in range(1, num_lists + 1)]
+
+def assignment_frame(matrix, names=None):
+    """Wrap a condition matrix in the item_assignment.csv layout that stimgen reads."""
+    matrix = np.asarray(matrix)
+    names = names or list_names(matrix.shape[1])
+    frame = pd.DataFrame(matrix, columns=names)
+    frame.insert(0, 'Item:', np.arange(1, len(frame) + 1))
+    return frame
+
+def build_assignments(num_items, num_lists, conditions=NUM_CONDITIONS, blocked=False, shift=0, names=None):
+    """Build, check and wrap a Latin-square assignment, ready to pass to stimgen.generate_all_lists."""
+    blocks = LANGUAGE_BLOCKS if blocked else None
+    matrix = latin_square(num_items, num_lists, conditions, blocks=blocks, shift=shift)
+    problems = check_balance(matrix, conditions, blocks=blocks)
+    if problems:
+        raise ValueError("Unbalanced assignment: " + "; ".join(problems))
+    return assignment_frame(matrix, names)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a counterbalanced Latin-square item assignment.")
+    parser.add_argument('--items', type=int, required=True, help="number of items")
+    parser.add_argument('--lists', type=int, required=True, help="number of lists")
+    parser.add_argument('--conditions', type=int, default=NUM_CONDITIONS, help="number of conditions")
+    parser.add_argument('--blocked', action='store_true', help="block each list by language (conditions 1-8, 9-16)")
+    parser.add_argument('--shift', type=int, default=0, help="rotate every list's starting condition by this much")
+    parser.add_argument('--output', default='item_assignment.csv')
+    args = parser.parse_args()
+    if args.blocked and args.conditions != NUM_CONDITIONS:
+        parser.error(f"--blocked uses the language blocks of the {NUM_CONDITIONS} conditions")
+
+    assignments = build_assignments(args.items, args.lists, args.conditions, blocked=args.blocked, shift=args.shift)
+    assignments.to_csv(args.output, index=False)
+    print(f"Assignment of {args.items} items to {args.lists} lists written to {args.output}")
@@ -0,0 +1,200 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import ajtconvert
+import item_randomize
+import optimize_items
+import stimgen
+import stimpair_filter
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+BASELINE_FILE = 'benchmarks_baseline.json'
+
+CONNECTORS = ['while', 'because', 'after', 'before', 'but', 'and']
+CONDITIONS = list(range(1, 17))
+
+def synthetic_verbs(num_items):
+    # The vocabulary grows with the pool, as a larger item bank would draw on more verbs
+    return [f"walk{i}s" for i in range(max(20, int(math.sqrt(num_items)) * 2))]
+
+def synthetic_items(num_items, rng):
+    """Return (number, verb1, connector, verb2) rows of strings, as the item CSVs hold them."""
+    verbs = synthetic_verbs(num_items)
+    return [(str(i + 1), rng.choice(verbs), rng.choice(CONNECTORS), rng.choice(verbs)) for i in range(num_items)]
+
+def synthetic_translations(num_items):
+    words = synthetic_verbs(num_items) + CONNECTORS
+    translations = pd.DataFrame({'english': words, 'french': [f"fr_{word}" for word in words]})
+    return translations.set_index('english')
+
+def synthetic_assignments(num_items, num_lists=4):
+    """Rotate the conditions across lists the way item_assignment.csv does."""
+    columns = {'Item:': range(1, num_items + 1)}
+    for list_index in range(num_lists):
+        columns[f"L{list_index + 1}"] = [CONDITIONS[(i + list_index * 4) % len(CONDITIONS)] for i in range(num_items)]
+    return pd.DataFrame(columns)
+
+def items_frame(items):
+    return pd.DataFrame(items, columns=['number', 'verb1', 'connector', 'verb2'])
+
+# Each setup function builds its inputs in workdir (untimed) and returns the call to time
+
+def setup_simulated_annealing(num_items, workdir, rng, iterations=20000):
+    # The chain length is fixed, so this measures how swap cost and setup grow with the pool, not convergence
+    data = synthetic_items(num_items, rng)
+    num_selected = max(10, num_items // 4)
+    verbs, connectors = optimize_items.count_verbs_and_connectors(data)
+    target_verbs, target_connectors = optimize_items.calculate_target_distribution(verbs, connectors, num_selected)
+    return lambda: optimize_items.simulated_annealing(data, num_selected, target_verbs, target_connectors,
+                                                      iterations=iterations, rng=random.Random(0))
+
+def setup_stimgen(num_items, workdir, rng):
+    items = items_frame(synthetic_items(num_items, rng))
+    lexicon = stimgen.Lexicon(synthetic_translations(num_items), synthetic_verbs(num_items) + CONNECTORS)
+    assignments = synthetic_assignments(num_items)
+
+    def run():
+        per_list = stimgen.list_tuples(stimgen.assignment_rows(assignments, items))
+        for list_num, rows in per_list.items():
+            stimgen.write_stimuli(stimgen.generate_list(list_num, rows, lexicon, seed=0),
+                                  os.path.join(workdir, f"stimuli_list_{list_num}.csv"))
+    return run
+
+def setup_transform_excel(num_items, workdir, rng):
+    items = items_frame(synthetic_items(num_items, rng))
+    lexicon = stimgen.Lexicon(synthetic_translations(num_items), synthetic_verbs(num_items) + CONNECTORS)
+    rows = stimgen.list_tuples(stimgen.assignment_rows(synthetic_assignments(num_items, num_lists=1), items))['L1']
+    input_file = os.path.join(workdir, 'stimuli_list_L1.xlsx')
+    stimgen.write_stimuli(stimgen.generate_list('L1', rows, lexicon, seed=0), input_file)
+    return lambda: ajtconvert.transform_excel(input_file, os.path.join(workdir, 'AJTL1.xlsx'))
+
+def setup_distribute(num_items, workdir, rng):
+    data = synthetic_items(num_items, rng)
+    return lambda: item_randomize.distribute_with_guaranteed_completion(data, rng=random.Random(0))
+
+def setup_process_file(num_items, workdir, rng):
+    # num_items sentence pairs, so twice as many rows
+    input_file = os.path.join(workdir, 'paired_sentences.csv')
+    sentences = [f"sentence {i}" for i in range(num_items * 2)]
+    pd.DataFrame({'sentence': sentences, 'surprisal': [rng.random() * 50 for _ in sentences]}).to_csv(input_file,
+                                                                                                       index=False)
+    return lambda: stimpair_filter.process_file(input_file, os.path.join(workdir, 'filtered.csv'), 'surprisal')
+
+BENCHMARKS = {
+    'simulated_annealing': setup_simulated_annealing,
+    'stimgen': setup_stimgen,
+    'transform_excel': setup_transform_excel,
+    'distribute': setup_distribute,
+    'process_file': setup_process_file,
+}
+
+def measure(setup, num_items, repeat=3, memory=True, seed=0):
+    """Time the benchmark at one size (best of repeat runs) and, separately, its peak traced memory."""
+    with tempfile.TemporaryDirectory() as workdir:
+        run = setup(num_items, workdir, random.Random(seed))
+        # Silence the scripts' progress messages so they do not skew or clutter the timings
+        with contextlib.redirect_stdout(io.StringIO()):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+            peak = None
+            if memory:
+                # Tracing slows allocation down, so memory gets its own run instead of sharing the timed ones
+                tracemalloc.start()
+                run()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+    seconds = min(timings)
+    return {'seconds': seconds, 'items_per_second': num_items / seconds if seconds else None, 'peak_bytes': peak}
+
+def scaling_exponent(results):
+    """Slope of log(time) against log(size): about 1 for linear scaling, 2 for quadratic."""
+    sizes = sorted(int(size) for size in results)
+    if len(sizes) < 2:
+        return None
+    seconds = [results[str(size)]['seconds'] for size in sizes]
+    return float(np.polyfit(np.log(sizes), np.log(seconds), 1)[0])
+
+def run_benchmarks(names, sizes, repeat=3, memory=True):
+    results = {}
+    for name in names:
+        results[name] = {'sizes': {}}
+        for size in sizes:
+            print(f"Running {name} with {size} items...", flush=True)
+            results[name]['sizes'][str(size)] = measure(BENCHMARKS[name], size, repeat=repeat, memory=memory)
+        results[name]['exponent'] = scaling_exponent(results[name]['sizes'])
+    return results
+
+def print_report(results):
+    print(f"\n{'benchmark':<22}{'items':>9}{'seconds':>11}{'items/s':>13}{'peak MB':>10}")
+    for name, result in results.items():
+        for size, row in result['sizes'].items():
+            peak = f"{row['peak_bytes'] / 2 ** 20:.1f}" if row['peak_bytes'] is not None else '-'
+            print(f"{name:<22}{size:>9}{row['seconds']:>11.4f}{row['items_per_second']:>13.0f}{peak:>10}")
+        if result['exponent'] is not None:
+            print(f"{name:<22}{'scaling exponent':>20} {result['exponent']:.2f}")
+
+def compare_to_baseline(results, baseline, threshold):
+    """Return (benchmark, size, baseline seconds, seconds) for every run slower than the baseline by over threshold."""
+    regressions = []
+    for name, result in results.items():
+        for size, row in result['sizes'].items():
+            previous = baseline.get('results', {}).get(name, {}).get('sizes', {}).get(size)
+            if previous and row['seconds'] > previous['seconds'] * (1 + threshold):
+                regressions.append((name, size, previous['seconds'], row['seconds']))
+    return regressions
+
+def save_baseline(results, filename):
+    baseline = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(baseline, f, indent=2)
+    os.replace(tmp_filename, filename)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the pipeline stages on synthetic item pools of several sizes.")
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help="benchmarks to run (default: all)")
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES, help="item pool sizes")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per size; the fastest is reported")
+    parser.add_argument('--no-memory', action='store_true', help="skip the peak memory run")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="baseline results file")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="slowdown over the baseline that counts as a regression (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    stimgen.logger.setLevel(logging.WARNING)
+    results = run_benchmarks(args.benchmarks, args.sizes, repeat=args.repeat, memory=not args.no_memory)
+    print_report(results)
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\nRegressions over {args.threshold:.0%} against {args.baseline}:")
+            for name, size, previous, seconds in regressions:
+                print(f"{name} with {size} items: {previous:.4f}s -> {seconds:.4f}s")
+            raise SystemExit(1)
+        print(f"\nNo regressions over {args.threshold:.0%} against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,8 @@
+import argparse
+import csv
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pptx import Presentation
 from pptx.util import Pt, Inches
 from pptx.enum.text import PP_ALIGN
@@ -27,39 +32,93 @@ sentence_pairs = [
 
 ]
 
-# The rest of the script remains the same
-# Create a new presentation with widescreen (16:9) slide layout
-prs = Presentation()
-prs.slide_width = Inches(16)
-prs.slide_height = Inches(9)
+# Widescreen (16:9) slide size used when no template is given
+SLIDE_WIDTH = Inches(16)
+SLIDE_HEIGHT = Inches(9)
+BLANK_LAYOUT = 6
 
-# Define slide layout
-blank_slide_layout = prs.slide_layouts[6]
+# Template files read once per process and reused for every deck built from them
+_template_cache = {}
 
-def add_slide_with_sentences(sentence1, sentence2):
-    slide = prs.slides.add_slide(blank_slide_layout)
+def new_presentation(template=None):
+    if template is None:
+        prs = Presentation()
+        prs.slide_width = SLIDE_WIDTH
+        prs.slide_height = SLIDE_HEIGHT
+        return prs
+    if template not in _template_cache:
+        with open(template, 'rb') as f:
+            _template_cache[template] = f.read()
+    return Presentation(io.BytesIO(_template_cache[template]))
+
+def add_sentence(paragraph, sentence):
+    paragraph.alignment = PP_ALIGN.LEFT
+    run = paragraph.add_run()
+    run.text = sentence
+    run.font.size = Pt(44)
+
+def add_slide_with_sentences(prs, layout, sentence1, sentence2):
+    slide = prs.slides.add_slide(layout)
     
     # Add a text box
     left = Inches(1)
     top = Inches(2.5)  # Adjusted to center vertically
-    width = Inches(14)
+    width = prs.slide_width - Inches(2)
     height = Inches(4)  # Reduced height to better fit content
     txBox = slide.shapes.add_textbox(left, top, width, height)
     tf = txBox.text_frame
     tf.word_wrap = True
     
-    # Add first sentence
-    p = tf.add_paragraph()
-    p.alignment = PP_ALIGN.LEFT
-    run = p.add_run()
-    run.text = sentence1
-    run.font.size = Pt(44)
-    
-   
+    # Add both sentences, one paragraph each
+    add_sentence(tf.paragraphs[0], sentence1)
+    second = tf.add_paragraph()
+    second.space_before = Pt(24)
+    add_sentence(second, sentence2)
+
+def load_pairs(filename):
+    """Read sentence pairs from the first two columns of a CSV file with a header row."""
+    with open(filename, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)  # Skip header
+        return [(row[0], row[1]) for row in reader if row]
+
+def build_deck(pairs, output_file, template=None, layout_index=BLANK_LAYOUT):
+    """Build a deck with one slide per sentence pair, using a layout of the template (or a blank widescreen deck).
+
+    Slides already in the template are kept ahead of the generated ones.
+    """
+    prs = new_presentation(template)
+    layout = prs.slide_layouts[layout_index]
+    for sentence1, sentence2 in pairs:
+        add_slide_with_sentences(prs, layout, sentence1, sentence2)
+    prs.save(output_file)
+    return output_file
+
+def _build_deck_from_csv(pairs_file, output_file, template, layout_index):
+    return build_deck(load_pairs(pairs_file), output_file, template, layout_index)
+
+def build_decks(jobs, template=None, layout_index=BLANK_LAYOUT, processes=None):
+    """Build many decks concurrently; jobs is a list of (pairs CSV, output .pptx) tuples."""
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_build_deck_from_csv, [pairs_file for pairs_file, _ in jobs],
+                                 [output_file for _, output_file in jobs], [template] * len(jobs),
+                                 [layout_index] * len(jobs)))
 
-# Add slides for each sentence pair
-for pair in sentence_pairs:
-    add_slide_with_sentences(pair[0], pair[1])
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build comprehension question slide decks from sentence pairs.")
+    parser.add_argument('pair_files', nargs='*',
+                        help="CSV files of sentence pairs, one deck each (default: the built-in pairs)")
+    parser.add_argument('--template', default=None, help="template .pptx whose layout the slides use")
+    parser.add_argument('--layout', type=int, default=BLANK_LAYOUT, help="index of the template slide layout")
+    parser.add_argument('--output-dir', default='.', help="directory for decks built from CSV files")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
 
-# Save the presentation
-prs.save('french_sentences.pptx')
\ No newline at end of file
+    if args.pair_files:
+        jobs = [(pairs_file, os.path.join(args.output_dir, os.path.splitext(os.path.basename(pairs_file))[0] + '.pptx'))
+                for pairs_file in args.pair_files]
+        for output_file in build_decks(jobs, args.template, args.layout, args.processes):
+            print(f"Saved {output_file}")
+    else:
+        # Save the presentation
+        build_deck(sentence_pairs, 'french_sentences.pptx', args.template, args.layout)
@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+# Set in the environment by enable(), so worker processes started afterwards record too
+ENV_VARIABLE = 'NEUROLING_PROFILE'
+
+class Profiler:
+    """Per-stage wall-clock timers and named counters for one process.
+
+    While disabled, stage() hands back a shared no-op context and count() returns at once, so instrumented
+    code pays a single attribute check per call.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []  # (stage name, start in microseconds, duration in microseconds, pid, thread id)
+        self.counters = Counter()
+        self._null = nullcontext()
+
+    def stage(self, name):
+        if not self.enabled:
+            return self._null
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            self.events.append((name, start // 1000, (end - start) // 1000, os.getpid(), threading.get_ident()))
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def collect(self):
+        """Return and clear what this process recorded, e.g. to send it back from a pool worker."""
+        snapshot = {'events': self.events, 'counters': dict(self.counters)}
+        self.events = []
+        self.counters = Counter()
+        return snapshot
+
+    def merge(self, snapshot):
+        if snapshot is None:
+            return
+        self.events.extend(tuple(event) for event in snapshot['events'])
+        self.counters.update(snapshot['counters'])
+
+    def summary(self):
+        """Total seconds and call count per stage, plus the counters and the rates derived from them."""
+        stages = {}
+        for name, _, duration, _, _ in self.events:
+            entry = stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            entry['seconds'] += duration / 1e6
+            entry['calls'] += 1
+        rates = {}
+        for prefix in ('sa', 'batch'):
+            if self.counters.get(f'{prefix}_steps'):
+                rates[f'{prefix}_acceptance_rate'] = self.counters[f'{prefix}_accepted'] / self.counters[f'{prefix}_steps']
+        return {'stages': stages, 'counters': dict(self.counters), 'rates': rates}
+
+    def chrome_trace(self):
+        """Return the profile in Chrome trace event format (chrome://tracing, Perfetto).
+
+        Stages become complete ("X") events; the summary rides along as metadata, so the same file is also a
+        plain JSON report.
+        """
+        events = [{'name': name, 'ph': 'X', 'ts': start, 'dur': duration, 'pid': pid, 'tid': tid}
+                  for name, start, duration, pid, tid in self.events]
+        if self.events and self.counters:
+            end = max(start + duration for _, start, duration, _, _ in self.events)
+            events.append({'name': 'counters', 'ph': 'C', 'ts': end, 'pid': os.getpid(), 'args': dict(self.counters)})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', **self.summary()}
+
+    def write(self, filename):
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.chrome_trace(), f, indent=1)
+        os.replace(tmp_filename, filename)
+
+profiler = Profiler(enabled=os.environ.get(ENV_VARIABLE) == '1')
+
+# A forked worker starts with an empty record; whatever it inherited is reported by the parent.
+# Windows has no fork (or register_at_fork); its spawned workers start empty anyway
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: profiler.collect())
+
+def enable():
+    profiler.enabled = True
+    os.environ[ENV_VARIABLE] = '1'
+
+def stage(name):
+    return profiler.stage(name)
+
+def count(name, value=1):
+    if profiler.enabled:
+        profiler.counters[name] += value
+
+def collect():
+    """Snapshot for a pool worker to return to the parent, or None when profiling is off."""
+    return profiler.collect() if profiler.enabled else None
+
+def merge(snapshot):
+    profiler.merge(snapshot)
+
+def write_profile(filename):
+    profiler.write(filename)
+    summary = profiler.summary()
+    for name, entry in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"{name}: {entry['seconds']:.3f}s over {entry['calls']} calls")
+    for name, value in sorted(summary['counters'].items()):
+        print(f"{name}: {value}")
+    for name, value in summary['rates'].items():
+        print(f"{name}: {value:.1%}")
+    print(f"Profile written to {filename}")
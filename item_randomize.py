@@ -1,6 +1,15 @@
+import argparse
 import csv
+import heapq
+import os
 import random
-from collections import defaultdict
+import shutil
+import tempfile
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from itemstore import load_items
+import instrument
 
 def read_csv(filename):
     with open(filename, 'r') as file:
@@ -14,61 +23,307 @@ def write_csv(filename, data):
         writer.writerow(['number', 'verb1', 'connector', 'verb2'])
         writer.writerows(data)
 
-def distribute_with_guaranteed_completion(data):
-    # Group data by connector
-    connector_groups = defaultdict(list)
-    for row in data:
-        connector_groups[row[1]].append(row)
-    
-    # Shuffle each group
-    for group in connector_groups.values():
-        random.shuffle(group)
-    
-    # Create a list of all connectors, repeated based on their frequency
-    all_connectors = []
-    for connector, group in connector_groups.items():
-        all_connectors.extend([connector] * len(group))
-    
-    # Shuffle the list of all connectors
-    random.shuffle(all_connectors)
-    
-    result = []
-    connector_index = {}
-    total_items = len(data)
-    
-    for i, connector in enumerate(all_connectors):
-        # Try to maintain some distance between same connectors
-        if i > 0 and connector == all_connectors[i-1]:
-            # If we have a repeat, try to swap with a nearby different connector
-            for j in range(i+1, min(i+5, len(all_connectors))):
-                if all_connectors[j] != connector:
-                    all_connectors[i], all_connectors[j] = all_connectors[j], all_connectors[i]
-                    connector = all_connectors[i]
-                    break
-        
-        # Get the next row for this connector
-        row = connector_groups[connector][connector_index.get(connector, 0)]
-        connector_index[connector] = connector_index.get(connector, 0) + 1
-        
-        # Add to result with a number
-        result.append((i+1, *row))
-        
-        # Print progress
-        if (i+1) % 10 == 0 or i+1 == total_items:
-            print(f"Progress: {i+1}/{total_items} items processed")
-    
-    return result
+# Column layout of optimize_items output
+ITEM_COLUMNS = ['number', 'verb1', 'connector', 'verb2']
+
+# How far a heap entry may overstate a row's current urgency before it is refreshed
+STALE_TOLERANCE = 1.1
+
+class SequencingError(Exception):
+    """Raised when no order of the items satisfies the minimum distances."""
+
+def check_feasible(data, min_distances, columns, words=None):
+    # A value used c times needs at least (c - 1) * d + 1 positions to keep its repeats d apart
+    for name, distance in min_distances.items():
+        counts = Counter(row[columns.index(name)] for row in data)
+        value, count = counts.most_common(1)[0] if counts else (None, 0)
+        if count and (count - 1) * distance + 1 > len(data):
+            if words is not None and name != 'number':
+                value = words[value]  # Rows from an ItemStore hold word ids; report the word itself
+            raise SequencingError(f"{name} '{value}' appears {count} times, which cannot be spaced {distance} apart "
+                                  f"in {len(data)} items")
+
+def sequence_items(data, min_distances, columns=ITEM_COLUMNS, rng=random, max_backtracks=100000, words=None):
+    """Order rows so that repeats of each constrained column are at least min_distances[column] positions apart.
+
+    A distance of 2 forbids adjacent repeats, 3 also forbids repeats with one item in between, and so on.
+
+    Rows are grouped by the hardest constrained column. Each position takes the group with the most rows left
+    whose value is off cooldown, and from it the row whose values have the most repeats still to place, using a
+    lazily updated heap per group. A step costs O(k log n) for k groups. Dead ends are resolved by backtracking;
+    SequencingError is raised when the constraints cannot be met or max_backtracks is used up. words, given
+    for integer-encoded rows (ItemStore.words), turns word ids back into words in the error messages.
+    """
+    for name in min_distances:
+        if name not in columns:
+            raise ValueError(f"Unknown column '{name}', expected one of {columns}")
+    fields = [(columns.index(name), distance) for name, distance in min_distances.items() if distance > 1]
+    rows = list(data)
+    rng.shuffle(rows)
+    if not fields:
+        return rows
+    check_feasible(rows, min_distances, columns, words)
+
+    # Rows still to place per value of each field
+    remaining = [Counter(row[index] for row in rows) for index, _ in fields]
+
+    # Group by the field whose most common value is hardest to spread out
+    primary_field = max(range(len(fields)), key=lambda f: (max(remaining[f].values()) - 1) * fields[f][1])
+    primary, primary_distance = fields[primary_field]
+    group_sizes = remaining[primary_field]
+    tiebreak = {value: rng.random() for value in group_sizes}
+
+    def urgency(item):
+        row = rows[item]
+        return sum(count[row[index]] * distance for count, (index, distance) in zip(remaining, fields))
+
+    # Heap entries are (-urgency, row id). Urgencies only shrink while placing, so entries are not updated in
+    # place; a popped entry is re-pushed only when it overstates the row's urgency by more than STALE_TOLERANCE
+    heaps = defaultdict(list)
+    for item, row in enumerate(rows):
+        heaps[row[primary]].append((-urgency(item), item))
+    for heap in heaps.values():
+        heapq.heapify(heap)
+
+    last_seen = [{} for _ in fields]
+    is_placed = [False] * len(rows)
+
+    def available(row, pos):
+        return all(pos - seen.get(row[index], -distance) >= distance
+                   for seen, (index, distance) in zip(last_seen, fields))
+
+    def top_available(value, pos):
+        heap = heaps[value]
+        set_aside = []
+        seen = set()
+        found = None
+        while heap:
+            neg_urgency, item = heapq.heappop(heap)
+            if is_placed[item] or item in seen:
+                continue
+            current = urgency(item)
+            if -neg_urgency > current * STALE_TOLERANCE:
+                heapq.heappush(heap, (-current, item))
+                continue
+            seen.add(item)
+            set_aside.append((-current, item))
+            if available(rows[item], pos):
+                found = item
+                break
+        for entry in set_aside:
+            heapq.heappush(heap, entry)
+        return found
+
+    def candidates(pos):
+        # The most urgent available row of each group whose value is off cooldown, most-remaining group first
+        primary_seen = last_seen[primary_field]
+        result = []
+        for value in sorted(group_sizes, key=lambda v: (-group_sizes[v], tiebreak[v])):
+            if not group_sizes[value]:
+                break
+            if pos - primary_seen.get(value, -primary_distance) < primary_distance:
+                continue
+            item = top_available(value, pos)
+            if item is not None:
+                result.append(item)
+        return result
+
+    order = []
+    previous_seen = []  # last_seen values overwritten by each placement, for undoing it
+    frames = []  # candidate rows still to try at each position
+    backtracks = 0
+
+    while len(order) < len(rows):
+        pos = len(order)
+        if len(frames) == pos:
+            frames.append(candidates(pos))
+        if frames[pos]:
+            item = frames[pos].pop(0)
+            row = rows[item]
+            previous_seen.append([seen.get(row[index]) for seen, (index, _) in zip(last_seen, fields)])
+            for seen, count, (index, _) in zip(last_seen, remaining, fields):
+                seen[row[index]] = pos
+                count[row[index]] -= 1
+            is_placed[item] = True
+            order.append(item)
+            continue
+
+        # Dead end: undo the previous placement and try its next candidate
+        frames.pop()
+        if not order or backtracks >= max_backtracks:
+            raise SequencingError(f"Could not satisfy minimum distances {min_distances} "
+                                  f"(placed {len(order)} of {len(rows)} items after {backtracks} backtracks)")
+        backtracks += 1
+        item = order.pop()
+        row = rows[item]
+        for seen, count, (index, _), previous in zip(last_seen, remaining, fields, previous_seen.pop()):
+            count[row[index]] += 1
+            if previous is None:
+                del seen[row[index]]
+            else:
+                seen[row[index]] = previous
+        is_placed[item] = False
+        heapq.heappush(heaps[row[primary]], (-urgency(item), item))
+
+    instrument.count('backtracks', backtracks)
+    return [rows[item] for item in order]
+
+def distribute_with_guaranteed_completion(data, min_distances=None, rng=random, words=None):
+    """Number the items in an order that keeps repeats apart (by default, no adjacent repeated connectors)."""
+    if min_distances is None:
+        min_distances = {'connector': 2}
+    with instrument.stage('sequence_items'):
+        ordered = sequence_items(data, min_distances, rng=rng, words=words)
+    instrument.count('items_sequenced', len(ordered))
+    return [(i+1, *row) for i, row in enumerate(ordered)]
+
+def participant_rng(seed, participant, session):
+    """Return the RNG stream for one participant and session, derived from the master seed only."""
+    return random.Random(f"{seed}:{participant}:{session}")
+
+_worker_items = None
+
+def _init_worker(data, min_distances, words):
+    global _worker_items
+    _worker_items = (data, min_distances, words)
+
+def _participant_order(participant, session, seed):
+    data, min_distances, words = _worker_items
+    try:
+        order = distribute_with_guaranteed_completion(data, min_distances, rng=participant_rng(seed, participant, session),
+                                                      words=words)
+    except SequencingError as e:
+        raise SequencingError(f"participant {participant}, session {session}: {e}") from None
+    return order, instrument.collect()
+
+def generate_participant_orders(data, participants, sessions=1, min_distances=None, seed=0, processes=None,
+                                words=None):
+    """Yield (participant, session, numbered rows) for every participant and session, in that order.
+
+    Each order comes from its own seeded stream, so any single order can be reproduced from the master seed
+    without regenerating the others, and results do not depend on the number of worker processes.
+    """
+    keys = [(participant, session) for participant in range(1, participants + 1) for session in range(1, sessions + 1)]
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(data, min_distances, words)) as executor:
+        orders = executor.map(_participant_order, [p for p, _ in keys], [s for _, s in keys], [seed] * len(keys),
+                              chunksize=max(1, len(keys) // 64))
+        for (participant, session), (order, profile) in zip(keys, orders):
+            instrument.merge(profile)
+            yield participant, session, order
+
+ORDER_COLUMNS = ['participant', 'session', 'position', 'item', 'verb1', 'connector', 'verb2']
+
+def write_orders_long(orders, filename):
+    """Write all orders as one long-format table: one row per participant, session and position.
+
+    Orders are generated while writing, so the table goes to a temporary file that replaces filename only once
+    every order has been written; on an error (e.g. a SequencingError) no partial file is left behind.
+    """
+    rows = ((participant, session, *row) for participant, session, order in orders for row in order)
+    tmp_filename = filename + '.tmp'
+    try:
+        if filename.endswith('.parquet'):
+            import pandas as pd  # Parquet output is optional; the CSV path needs only the standard library
+            pd.DataFrame(list(rows), columns=ORDER_COLUMNS).to_parquet(tmp_filename, index=False)
+        else:
+            with open(tmp_filename, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(ORDER_COLUMNS)
+                writer.writerows(rows)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+def write_orders_directory(orders, directory):
+    """Write each order to its own participant_<p>_session_<s>.csv file in directory.
+
+    The files are staged in a temporary directory and moved into directory only after every order has been
+    written, so an error part way through leaves directory as it was.
+    """
+    # Staged next to directory, so the final moves stay on one file system
+    staging_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(directory)), prefix='.orders-')
+    try:
+        names = []
+        for participant, session, order in orders:
+            name = f"participant_{participant}_session_{session}.csv"
+            write_csv(os.path.join(staging_dir, name), order)
+            names.append(name)
+        os.makedirs(directory, exist_ok=True)
+        for name in names:
+            os.replace(os.path.join(staging_dir, name), os.path.join(directory, name))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+def distribute_file(items, output_file, min_distances=None, seed=None):
+    """Sequence the items (an item CSV or a loaded ItemStore) and write the numbered order to output_file."""
+    store = load_items(items) if isinstance(items, str) else items
+    distributed_data = distribute_with_guaranteed_completion(store.rows(), min_distances, rng=random.Random(seed),
+                                                             words=store.words)
+    write_csv(output_file, store.decode_rows(distributed_data))
+    return distributed_data
+
+def parse_min_distance(text):
+    name, _, distance = text.partition('=')
+    if name not in ITEM_COLUMNS or not distance.isdigit():
+        raise argparse.ArgumentTypeError(f"expected COLUMN=N with COLUMN one of {ITEM_COLUMNS}, got '{text}'")
+    return name, int(distance)
 
 def main():
+    parser = argparse.ArgumentParser(description="Order the optimized items with minimum distances between repeats.")
+    parser.add_argument('--min-distance', type=parse_min_distance, action='append', default=None,
+                        metavar='COLUMN=N', help="minimum distance between repeats of a column (default: connector=2)")
+    parser.add_argument('--seed', type=int, default=None, help="seed for a reproducible order")
+    parser.add_argument('--participants', type=int, default=None,
+                        help="bulk mode: generate one order per participant and session")
+    parser.add_argument('--sessions', type=int, default=1, help="sessions per participant in bulk mode")
+    parser.add_argument('--output', default='participant_orders.csv',
+                        help="bulk mode output: a .csv/.parquet file, or a directory for one file per order")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--profile', default=None,
+                        help="record stage timings and counters and write them to this JSON/Chrome trace file")
+    args = parser.parse_args()
+    if args.profile:
+        instrument.enable()
+
     input_file = 'optimized_items_full_uniqueness.csv'
     output_file = 'guaranteed_completion_distributed_items.csv'
 
-    data = read_csv(input_file)
+    # Sequence integer-encoded rows and decode them only for writing
+    store = load_items(input_file)
+    data = store.rows()
     print(f"Total items to process: {len(data)}")
-    distributed_data = distribute_with_guaranteed_completion(data)
-    write_csv(output_file, distributed_data)
+    min_distances = dict(args.min_distance) if args.min_distance else None
+
+    if args.participants:
+        seed = args.seed if args.seed is not None else 0
+        orders = ((participant, session, store.decode_rows(order))
+                  for participant, session, order in generate_participant_orders(
+                      data, args.participants, args.sessions, min_distances, seed=seed, processes=args.processes,
+                      words=store.words))
+        try:
+            if args.output.endswith(('.csv', '.parquet')):
+                write_orders_long(orders, args.output)
+            else:
+                write_orders_directory(orders, args.output)
+        except SequencingError as e:
+            print(f"Error: {e}")
+            return
+        print(f"{args.participants * args.sessions} participant orders have been written to {args.output}")
+        if args.profile:
+            instrument.write_profile(args.profile)
+        return
+
+    try:
+        distribute_file(store, output_file, min_distances, seed=args.seed)
+    except SequencingError as e:
+        print(f"Error: {e}")
+        return
 
     print(f"Guaranteed completion distributed data has been written to {output_file}")
+    if args.profile:
+        instrument.write_profile(args.profile)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
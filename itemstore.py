@@ -0,0 +1,151 @@
+import csv
+import hashlib
+import os
+import pickle
+from array import array
+
+# Columns located by name in the CSV header; files without them use the optimize_items layout
+ITEM_COLUMNS = ['number', 'verb1', 'connector', 'verb2']
+WORD_COLUMNS = ['verb1', 'connector', 'verb2']
+
+# Bump when the cache layout changes so old cache files are rebuilt instead of misread
+CACHE_VERSION = 1
+
+class ItemStore:
+    """Items with verbs and connectors interned to integer ids, held in typed arrays.
+
+    Each item is a number (kept as text, as in the CSV) and three word ids into words. Comparing or hashing
+    an item compares small integers instead of strings, and each word is stored once however often it is used.
+    """
+
+    def __init__(self, words=(), numbers=(), verb1=(), connector=(), verb2=()):
+        self.words = list(words)
+        self.ids = {word: word_id for word_id, word in enumerate(self.words)}
+        self.numbers = list(numbers)
+        self.verb1 = array('i', verb1)
+        self.connector = array('i', connector)
+        self.verb2 = array('i', verb2)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def intern(self, word):
+        word_id = self.ids.get(word)
+        if word_id is None:
+            word_id = self.ids[word] = len(self.words)
+            self.words.append(word)
+        return word_id
+
+    def append(self, number, verb1, connector, verb2):
+        self.numbers.append(number)
+        self.verb1.append(self.intern(verb1))
+        self.connector.append(self.intern(connector))
+        self.verb2.append(self.intern(verb2))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a store from (number, verb1, connector, verb2) rows of strings."""
+        store = cls()
+        for number, verb1, connector, verb2 in rows:
+            store.append(number, verb1, connector, verb2)
+        return store
+
+    @classmethod
+    def from_csv(cls, filename):
+        """Read items from a CSV file with a header row.
+
+        The word columns are found by name when the header has them, otherwise the item is taken from the first
+        four fields (number, verb1, connector, verb2) as optimize_items writes them. Rows with more fields than
+        the header have a leading index column, which becomes the item number, as pandas reads them.
+        """
+        with open(filename, 'r', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            store = cls()
+            if all(name in header for name in WORD_COLUMNS):
+                number = header.index('number') if 'number' in header else 0
+                positions = [number] + [header.index(name) for name in WORD_COLUMNS]
+            else:
+                positions = [0, 1, 2, 3]
+            indexed = [0] + [position + 1 for position in positions[1:]]
+            for row in reader:
+                if not row:
+                    continue
+                store.append(*(row[position] for position in (indexed if len(row) > len(header) else positions)))
+        return store
+
+    def rows(self):
+        """Return the items as (number, verb1 id, connector id, verb2 id) tuples, the row layout the scripts use."""
+        return list(zip(self.numbers, self.verb1, self.connector, self.verb2))
+
+    def decode(self, row):
+        """Turn an encoded row back into strings; leading fields before the last four are passed through."""
+        words = self.words
+        *prefix, number, verb1, connector, verb2 = row
+        return (*prefix, number, words[verb1], words[connector], words[verb2])
+
+    def decode_rows(self, rows):
+        return [self.decode(row) for row in rows]
+
+    def decode_keys(self, mapping):
+        """Turn a mapping keyed by word id into one keyed by the word."""
+        return {self.words[word_id]: value for word_id, value in mapping.items()}
+
+    def frame(self):
+        """Return the items as a DataFrame with categorical word columns sharing the interned vocabulary."""
+        import pandas as pd  # Only stimgen works on DataFrames; the rest of the store needs only the standard library
+        columns = {'number': self.numbers}
+        for name in WORD_COLUMNS:
+            columns[name] = pd.Categorical.from_codes(list(getattr(self, name)), categories=self.words)
+        return pd.DataFrame(columns)
+
+    def save(self, filename, source_hash=None):
+        state = {'version': CACHE_VERSION, 'source': source_hash, 'words': self.words, 'numbers': self.numbers,
+                 'verb1': self.verb1, 'connector': self.connector, 'verb2': self.verb2}
+        # Per-process temporary name, as parallel workers may build the same cache at once
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+
+    @classmethod
+    def load(cls, filename, source_hash=None):
+        """Reload a saved store; returns None if the file is from another version or another source file."""
+        with open(filename, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != CACHE_VERSION or (source_hash is not None and state['source'] != source_hash):
+            return None
+        store = cls()
+        store.words = state['words']
+        store.ids = {word: word_id for word_id, word in enumerate(store.words)}
+        store.numbers = state['numbers']
+        store.verb1, store.connector, store.verb2 = state['verb1'], state['connector'], state['verb2']
+        return store
+
+def file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_items(filename, cache_file=None):
+    """Load an item CSV, reusing the binary cache next to it while the CSV contents are unchanged.
+
+    The cache defaults to <filename>.items; pass cache_file=False to always parse the CSV.
+    """
+    if cache_file is False:
+        return ItemStore.from_csv(filename)
+    if cache_file is None:
+        cache_file = filename + '.items'
+    source_hash = file_hash(filename)
+    if os.path.exists(cache_file):
+        try:
+            store = ItemStore.load(cache_file, source_hash)
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+            store = None
+        if store is not None:
+            return store
+    store = ItemStore.from_csv(filename)
+    store.save(cache_file, source_hash)
+    return store
@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+
+import pandas as pd
+
+import instrument
+from itemstore import file_hash
+
+# The coercions ComponentModels.Rmd used to apply after read_excel
+FACTOR_COLUMNS = ['Language', 'Character', 'Acceptability', 'subject', 'item', 'chlabel', 'session']
+NUMERIC_COLUMNS = ['secs_cen', 'sp3d_cen', 'iat_cen', 'cq_d_cen']
+MIDLINE_CHANNELS = ['Fz', 'Cz', 'Pz']
+
+OUTPUT_DIR = 'model_data'
+MANIFEST = 'manifest.json'
+EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather'}
+
+# Bump when the partition layout or dtypes change so existing partitions are rebuilt
+PARTITION_VERSION = 1
+
+def as_factor(values):
+    """Categorical with string levels, so numeric codes such as subject ids come back as factors in R.
+
+    Numeric levels keep their numeric order (2 before 10), as as.factor orders them.
+    """
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+            values = values.astype('Int64')  # Whole-number ids read as floats when the column has blanks
+        levels = [str(level) for level in sorted(values.dropna().unique())]
+        return pd.Categorical(values.astype('string'), categories=levels)
+    return values.astype('category')
+
+def read_model_data(filename):
+    """Read the trial-level model data with the factor and numeric types the component models expect.
+
+    Factor levels are sorted as R's as.factor sorts them, and every partition keeps the full level set, as
+    subset() does in R. Numeric columns that do not parse become NaN (NA in R), as with as.numeric.
+    """
+    with instrument.stage('read_excel'):
+        df = pd.read_excel(filename)
+    for column in FACTOR_COLUMNS:
+        df[column] = as_factor(df[column])
+    for column in NUMERIC_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+    instrument.count('model_rows', len(df))
+    return df
+
+def partition_name(channel, fmt='parquet'):
+    return f"chlabel={channel}{EXTENSIONS[fmt]}"
+
+def write_frame(df, filename, fmt='parquet'):
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    if fmt == 'parquet':
+        df.to_parquet(tmp_filename, index=False)
+    else:
+        df.to_feather(tmp_filename)
+    os.replace(tmp_filename, filename)
+
+def load_manifest(output_dir):
+    manifest_file = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+def is_current(manifest, output_dir, source_hash, fmt):
+    """True when the manifest was written from this source, in this format and layout, and its files exist."""
+    return (manifest is not None and manifest.get('version') == PARTITION_VERSION
+            and manifest.get('source') == source_hash and manifest.get('format') == fmt
+            and all(os.path.exists(os.path.join(output_dir, name)) for name in manifest['partitions'].values()))
+
+def prepare(input_file='model_data.xlsx', output_dir=OUTPUT_DIR, fmt='parquet', force=False):
+    """Split the model data into one typed file per channel, unless the partitions already match its contents.
+
+    Returns the manifest: the SHA-256 of the source, the format and {channel: partition file name}. The
+    manifest is written last, so an interrupted run leaves the partitions to be rebuilt next time.
+    """
+    source_hash = file_hash(input_file)
+    manifest = load_manifest(output_dir)
+    if not force and is_current(manifest, output_dir, source_hash, fmt):
+        print(f"{output_dir} is up to date with {input_file}")
+        return manifest
+
+    df = read_model_data(input_file)
+    os.makedirs(output_dir, exist_ok=True)
+    partitions = {}
+    with instrument.stage('write_partitions'):
+        for channel, rows in df.groupby('chlabel', observed=True, sort=True):
+            name = partition_name(channel, fmt)
+            write_frame(rows.reset_index(drop=True), os.path.join(output_dir, name), fmt)
+            partitions[str(channel)] = name
+    missing = [channel for channel in MIDLINE_CHANNELS if channel not in partitions]
+    if missing:
+        print(f"Warning: {input_file} has no rows for {', '.join(missing)}")
+
+    # Partitions from an older source whose channels are gone would otherwise be left behind
+    if manifest is not None:
+        for name in set(manifest.get('partitions', {}).values()) - set(partitions.values()):
+            if os.path.exists(os.path.join(output_dir, name)):
+                os.remove(os.path.join(output_dir, name))
+
+    manifest = {'version': PARTITION_VERSION, 'source': source_hash, 'format': fmt, 'rows': len(df),
+                'partitions': partitions}
+    tmp_manifest = os.path.join(output_dir, f"{MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp_manifest, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_manifest, os.path.join(output_dir, MANIFEST))
+    print(f"{len(df)} rows from {input_file} written to {len(partitions)} partitions in {output_dir}")
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert model_data.xlsx into typed per-channel files for ComponentModels.Rmd.")
+    parser.add_argument('input', nargs='?', default='model_data.xlsx', help="trial-level model data workbook")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help="directory for the partitions and their manifest")
+    parser.add_argument('--format', choices=sorted(EXTENSIONS), default='parquet', help="columnar file format")
+    parser.add_argument('--force', action='store_true', help="rebuild even if the source is unchanged")
+    parser.add_argument('--profile', default=None,
+                        help="record stage timings and counters and write them to this JSON/Chrome trace file")
+    args = parser.parse_args()
+
+    if args.profile:
+        instrument.enable()
+    prepare(args.input, args.output_dir, fmt=args.format, force=args.force)
+    if args.profile:
+        instrument.write_profile(args.profile)
@@ -1,7 +1,16 @@
+import argparse
 import csv
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import random
 import math
+import os
+import pickle
+
+import numpy as np
+
+from itemstore import load_items
+import instrument
 
 def load_data(filename):
     with open(filename, 'r') as f:
@@ -25,8 +34,37 @@ def calculate_target_distribution(verbs, connectors, num_items):
     target_connectors = {c: (count / total_connectors) * num_items for c, count in connectors.items()}
     return target_verbs, target_connectors
 
-def initial_selection(data, num_items):
-    return random.sample(data, num_items)
+def initial_selection(data, num_items, rng=random):
+    # Sample row ids rather than rows so duplicate rows in the CSV stay distinct items
+    return rng.sample(range(len(data)), num_items)
+
+class SelectionPool:
+    """Selected and unselected item ids held in index-addressable arrays with a position map."""
+
+    def __init__(self, num_total, selected_ids, unselected_ids=None):
+        self.selected = list(selected_ids)
+        if unselected_ids is None:
+            chosen = set(self.selected)
+            self.unselected = [item_id for item_id in range(num_total) if item_id not in chosen]
+        else:
+            self.unselected = list(unselected_ids)
+        self.position = [0] * num_total
+        for slot, item_id in enumerate(self.selected):
+            self.position[item_id] = slot
+        for slot, item_id in enumerate(self.unselected):
+            self.position[item_id] = slot
+
+    def random_unselected_slot(self, rng=random):
+        return rng.randrange(len(self.unselected))
+
+    def swap(self, selected_slot, unselected_slot):
+        """Exchange the ids in the two slots, so each array keeps its length and order elsewhere."""
+        removed = self.selected[selected_slot]
+        added = self.unselected[unselected_slot]
+        self.selected[selected_slot] = added
+        self.unselected[unselected_slot] = removed
+        self.position[added] = selected_slot
+        self.position[removed] = unselected_slot
 
 def score_selection(selection, target_verbs, target_connectors, num_items):
     current_verbs = Counter()
@@ -57,41 +95,589 @@ def score_selection(selection, target_verbs, target_connectors, num_items):
 
     return -(verb_score + connector_score * 2 - combination_score * 10 + position_score + over_limit_penalty * 100 + repeat_penalty * 50)
 
-def simulated_annealing(data, num_items, target_verbs, target_connectors, initial_temp=100, cooling_rate=0.995, iterations=20000):
-    current_selection = initial_selection(data, num_items)
-    current_score = score_selection(current_selection, target_verbs, target_connectors, num_items)
-    best_selection = current_selection[:]
+class IncrementalScorer:
+    """Running-count version of score_selection that scores a single swap in O(1)."""
+
+    def __init__(self, selection, target_verbs, target_connectors, num_items):
+        self.target_verbs = target_verbs
+        self.target_connectors = target_connectors
+        self.num_items = num_items
+        self.max_verb_count = num_items * 0.1
+
+        self.current_verbs = Counter()
+        self.current_connectors = Counter()
+        self.full_combinations = Counter()
+        self.verb1_counts = Counter()
+        self.verb2_counts = Counter()
+        for item in selection:
+            self.current_verbs[item[1]] += 1
+            self.current_verbs[item[3]] += 1
+            self.current_connectors[item[2]] += 1
+            self.full_combinations[(item[1], item[2], item[3])] += 1
+            self.verb1_counts[item[1]] += 1
+            self.verb2_counts[item[3]] += 1
+
+        # Keep the penalty sums as running state; the score is derived from them
+        self.verb_cost = sum(self._verb_cost(v, self.current_verbs[v], self.verb1_counts[v], self.verb2_counts[v])
+                             for v in set(self.current_verbs) | set(target_verbs))
+        self.connector_cost = sum(self._connector_cost(c, self.current_connectors[c]) for c in target_connectors)
+        self.unique_combinations = len(self.full_combinations)
+        self.score = self._score(self.verb_cost, self.connector_cost, self.unique_combinations)
+
+    def _verb_cost(self, verb, count, verb1_count, verb2_count):
+        # Verb target, position balance and over-limit terms of score_selection for one verb
+        cost = max(0, count - self.max_verb_count) ** 2 * 100
+        if verb in self.target_verbs:
+            target = self.target_verbs[verb]
+            cost += (min(count, target) - target) ** 2 + (verb1_count - verb2_count) ** 2
+        return cost
+
+    def _connector_cost(self, connector, count):
+        if connector not in self.target_connectors:
+            return 0
+        return (count - self.target_connectors[connector]) ** 2 * 2
+
+    def _score(self, verb_cost, connector_cost, unique_combinations):
+        repeat_penalty = self.num_items - unique_combinations
+        return -(verb_cost + connector_cost - unique_combinations * 10 + repeat_penalty * 50)
+
+    def _deltas(self, old_item, new_item):
+        verb_deltas = defaultdict(lambda: [0, 0, 0])
+        verb_deltas[old_item[1]][0] -= 1
+        verb_deltas[old_item[1]][1] -= 1
+        verb_deltas[old_item[3]][0] -= 1
+        verb_deltas[old_item[3]][2] -= 1
+        verb_deltas[new_item[1]][0] += 1
+        verb_deltas[new_item[1]][1] += 1
+        verb_deltas[new_item[3]][0] += 1
+        verb_deltas[new_item[3]][2] += 1
+
+        connector_deltas = defaultdict(int)
+        connector_deltas[old_item[2]] -= 1
+        connector_deltas[new_item[2]] += 1
+
+        combination_deltas = defaultdict(int)
+        combination_deltas[(old_item[1], old_item[2], old_item[3])] -= 1
+        combination_deltas[(new_item[1], new_item[2], new_item[3])] += 1
+
+        return verb_deltas, connector_deltas, combination_deltas
+
+    def _cost_changes(self, verb_deltas, connector_deltas, combination_deltas):
+        verb_change = 0
+        for verb, (d_total, d_first, d_second) in verb_deltas.items():
+            count = self.current_verbs[verb]
+            first = self.verb1_counts[verb]
+            second = self.verb2_counts[verb]
+            verb_change += (self._verb_cost(verb, count + d_total, first + d_first, second + d_second)
+                            - self._verb_cost(verb, count, first, second))
+
+        connector_change = 0
+        for connector, d in connector_deltas.items():
+            count = self.current_connectors[connector]
+            connector_change += self._connector_cost(connector, count + d) - self._connector_cost(connector, count)
+
+        unique_change = 0
+        for combination, d in combination_deltas.items():
+            count = self.full_combinations[combination]
+            unique_change += (count + d > 0) - (count > 0)
+
+        return verb_change, connector_change, unique_change
+
+    def propose(self, old_item, new_item):
+        """Return the score the selection would have if old_item were replaced by new_item."""
+        verb_change, connector_change, unique_change = self._cost_changes(*self._deltas(old_item, new_item))
+        return self._score(self.verb_cost + verb_change,
+                           self.connector_cost + connector_change,
+                           self.unique_combinations + unique_change)
+
+    def apply(self, old_item, new_item):
+        """Replace old_item with new_item in the running counts and return the new score."""
+        verb_deltas, connector_deltas, combination_deltas = self._deltas(old_item, new_item)
+        verb_change, connector_change, unique_change = self._cost_changes(verb_deltas, connector_deltas, combination_deltas)
+
+        for verb, (d_total, d_first, d_second) in verb_deltas.items():
+            self.current_verbs[verb] += d_total
+            self.verb1_counts[verb] += d_first
+            self.verb2_counts[verb] += d_second
+        for connector, d in connector_deltas.items():
+            self.current_connectors[connector] += d
+        for combination, d in combination_deltas.items():
+            self.full_combinations[combination] += d
+            if self.full_combinations[combination] == 0:
+                del self.full_combinations[combination]
+
+        self.verb_cost += verb_change
+        self.connector_cost += connector_change
+        self.unique_combinations += unique_change
+        self.score = self._score(self.verb_cost, self.connector_cost, self.unique_combinations)
+        return self.score
+
+class GeometricSchedule:
+    """Fixed geometric cooling: the temperature is multiplied by cooling_rate after every step."""
+
+    # There is no acceptance band to leave, so patience counts from the first step
+    frozen = True
+
+    def __init__(self, initial_temp, cooling_rate):
+        self.temperature = initial_temp
+        self.cooling_rate = cooling_rate
+
+    def step(self, accepted):
+        self.temperature *= self.cooling_rate
+
+class AdaptiveSchedule:
+    """Cooling driven by the acceptance rate over a window of steps, ending at final_temp after iterations steps.
+
+    After each window the schedule works out the factor per window that would reach final_temp by the end of the
+    run. It cools by less than that while the acceptance rate is inside `band`, where most of the useful search
+    happens, and by more when the chain is too hot (accepting almost everything); later windows make up the
+    difference, so the run always finishes cold. The chain counts as frozen once a window's acceptance rate
+    falls below the band.
+    """
+
+    def __init__(self, initial_temp, iterations, final_temp=None, window=200, band=(0.02, 0.4), slow_power=0.5,
+                 fast_power=2.0):
+        self.temperature = initial_temp
+        self.final_temp = final_temp if final_temp is not None else initial_temp * 1e-8
+        self.windows_left = max(1, iterations // window)
+        self.window = window
+        self.band = band
+        self.slow_power = slow_power
+        self.fast_power = fast_power
+        self.frozen = False
+        self.steps = 0
+        self.accepted = 0
+
+    def step(self, accepted):
+        self.steps += 1
+        self.accepted += accepted
+        if self.steps < self.window:
+            return
+        acceptance_rate = self.accepted / self.steps
+        factor = min(1.0, self.final_temp / self.temperature) ** (1 / self.windows_left)
+        if self.windows_left > 1 and self.band[0] <= acceptance_rate <= self.band[1]:
+            factor **= self.slow_power
+        elif self.windows_left > 1 and acceptance_rate > self.band[1]:
+            factor **= self.fast_power
+        self.temperature *= factor
+        self.frozen = acceptance_rate < self.band[0]
+        self.windows_left = max(1, self.windows_left - 1)
+        self.steps = 0
+        self.accepted = 0
+
+def calibrate_temperature(data, num_items, target_verbs, target_connectors, selected_ids, rng=random, samples=200,
+                          acceptance=0.8):
+    """Pick a starting temperature at which a typical worsening swap is accepted with probability `acceptance`."""
+    pool = SelectionPool(len(data), selected_ids)
+    if not pool.unselected:
+        return 1.0
+    scorer = IncrementalScorer([data[item_id] for item_id in pool.selected], target_verbs, target_connectors, num_items)
+    worsening = []
+    for _ in range(samples):
+        remove_item = data[pool.selected[rng.randrange(num_items)]]
+        add_item = data[pool.unselected[pool.random_unselected_slot(rng)]]
+        delta = scorer.propose(remove_item, add_item) - scorer.score
+        if delta < 0:
+            worsening.append(-delta)
+    if not worsening:
+        return 1.0
+    return (sum(worsening) / len(worsening)) / -math.log(acceptance)
+
+def print_progress(info):
+    print(f"Iteration {info['iteration']}, Temperature: {info['temperature']:.2f}, Score: {info['score']:.2f}, "
+          f"Best: {info['best_score']:.2f}, Acceptance: {info['acceptance_rate']:.1%}")
+
+def anneal(data, num_items, target_verbs, target_connectors, selected_ids, schedule, iterations, rng=random,
+           trace=None, progress=None, progress_every=1000, patience=None, checkpoint=None, checkpoint_every=1000,
+           resume=None):
+    """Run annealing steps from selected_ids and return (selected_ids, score, best_ids, best_score, temperature).
+
+    progress is called every progress_every steps with a dict of the chain's iteration, temperature, score,
+    best_score and acceptance_rate. The run stops early once the best score has not improved for `patience`
+    steps while the schedule is frozen. checkpoint is called every checkpoint_every steps with a state dict that can be passed back as
+    `resume` to continue the run exactly where it left off.
+    """
+    start_iteration, stale, unselected_ids = 0, 0, None
+    if resume is not None:
+        selected_ids = resume['selected']
+        unselected_ids = resume['unselected']
+        schedule = resume['schedule']
+        start_iteration = resume['iteration']
+        stale = resume['stale']
+        rng.setstate(resume['rng_state'])
+
+    pool = SelectionPool(len(data), selected_ids, unselected_ids)
+    scorer = IncrementalScorer([data[item_id] for item_id in pool.selected], target_verbs, target_connectors, num_items)
+    current_score = scorer.score
+    best_selection = pool.selected[:]
     best_score = current_score
-    temperature = initial_temp
-
-    for i in range(iterations):
-        if i % 1000 == 0:
-            print(f"Iteration {i}, Temperature: {temperature:.2f}, Score: {current_score:.2f}")
+    if resume is not None:
+        best_selection, best_score = resume['best_selection'], resume['best_score']
+    window_accepted = 0
+    steps, total_accepted = 0, 0
+
+    for i in range(start_iteration, iterations):
+        if not pool.unselected:
+            break  # Every item is already selected, so there is nothing to swap in
+        if patience is not None and stale >= patience:
+            break
+
+        if checkpoint is not None and i > start_iteration and i % checkpoint_every == 0:
+            checkpoint({'iteration': i, 'selected': pool.selected[:], 'unselected': pool.unselected[:],
+                        'best_selection': best_selection,
+                        'best_score': best_score, 'stale': stale, 'schedule': schedule, 'rng_state': rng.getstate()})
 
         # Choose an item to remove and an item to add
-        remove_index = random.randint(0, num_items - 1)
-        add_item = random.choice([item for item in data if item not in current_selection])
-
-        # Create new selection
-        new_selection = current_selection[:]
-        new_selection[remove_index] = add_item
+        remove_index = rng.randint(0, num_items - 1)
+        add_index = pool.random_unselected_slot(rng)
 
-        # Calculate new score
-        new_score = score_selection(new_selection, target_verbs, target_connectors, num_items)
+        # Score the swap without rebuilding the counts
+        remove_item = data[pool.selected[remove_index]]
+        add_item = data[pool.unselected[add_index]]
+        new_score = scorer.propose(remove_item, add_item)
 
         # Decide whether to accept the new selection
-        if new_score > current_score or random.random() < math.exp((new_score - current_score) / temperature):
-            current_selection = new_selection
-            current_score = new_score
+        accepted = new_score > current_score or rng.random() < math.exp((new_score - current_score) / schedule.temperature)
+        if schedule.frozen:
+            stale += 1
+        steps += 1
+        if accepted:
+            current_score = scorer.apply(remove_item, add_item)
+            pool.swap(remove_index, add_index)
+            window_accepted += 1
+            total_accepted += 1
 
             if current_score > best_score:
-                best_selection = current_selection[:]
+                best_selection = pool.selected[:]
                 best_score = current_score
+                stale = 0
+
+        if trace is not None:
+            trace.append(current_score)
+
+        if progress is not None and (i + 1) % progress_every == 0:
+            progress({'iteration': i + 1, 'temperature': schedule.temperature, 'score': current_score,
+                      'best_score': best_score, 'acceptance_rate': window_accepted / progress_every})
+            window_accepted = 0
 
         # Cool down
-        temperature *= cooling_rate
+        schedule.step(accepted)
+
+    # Counted once per run rather than per step, so the loop itself carries no instrumentation
+    instrument.count('sa_steps', steps)
+    instrument.count('sa_accepted', total_accepted)
+    return pool.selected, current_score, best_selection, best_score, schedule.temperature
+
+def save_checkpoint(state, filename):
+    # Write to a temporary file first so an interrupted save never leaves a truncated checkpoint behind
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(tmp_filename, filename)
+
+def load_checkpoint(filename):
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+def simulated_annealing(data, num_items, target_verbs, target_connectors, initial_temp=100, cooling_rate=0.995, iterations=20000,
+                        rng=random, trace=None, schedule='geometric', patience=None, progress=None,
+                        checkpoint_path=None, checkpoint_every=1000, resume=False):
+    """Anneal a selection of num_items rows and return the best one found.
+
+    schedule is 'geometric' (fixed initial_temp and cooling_rate) or 'adaptive' (starting temperature calibrated
+    from sampled swaps, cooling driven by the acceptance rate). With checkpoint_path set, the chain state is
+    saved every checkpoint_every steps, and resume=True continues from that file when it exists.
+    """
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint = lambda state: save_checkpoint(state, checkpoint_path)
+    state = None
+    if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+        state = load_checkpoint(checkpoint_path)
+
+    selected_ids, chain_schedule = None, None
+    if state is None:
+        selected_ids = initial_selection(data, num_items, rng)
+        if schedule == 'adaptive':
+            initial_temp = calibrate_temperature(data, num_items, target_verbs, target_connectors, selected_ids, rng)
+            chain_schedule = AdaptiveSchedule(initial_temp, iterations)
+        else:
+            chain_schedule = GeometricSchedule(initial_temp, cooling_rate)
+
+    with instrument.stage('anneal'):
+        _, _, best_selection, _, _ = anneal(data, num_items, target_verbs, target_connectors, selected_ids,
+                                            chain_schedule, iterations, rng=rng, trace=trace, progress=progress,
+                                            patience=patience, checkpoint=checkpoint,
+                                            checkpoint_every=checkpoint_every, resume=state)
+    return [data[item_id] for item_id in best_selection]
+
+# Problem data shared with worker processes once via the pool initializer instead of per task
+_worker_problem = None
+
+def _init_worker(data, num_items, target_verbs, target_connectors):
+    global _worker_problem
+    _worker_problem = (data, num_items, target_verbs, target_connectors)
+
+def _run_chain(seed, initial_temp, cooling_rate, iterations):
+    rng = random.Random(seed)
+    data, num_items, target_verbs, target_connectors = _worker_problem
+    trace = []
+    selected_ids = initial_selection(data, num_items, rng)
+    with instrument.stage('anneal'):
+        _, _, best_ids, best_score, _ = anneal(data, num_items, target_verbs, target_connectors, selected_ids,
+                                               GeometricSchedule(initial_temp, cooling_rate), iterations, rng=rng,
+                                               trace=trace)
+    return best_ids, best_score, trace, instrument.collect()
+
+def _run_replica(seed, selected_ids, temperature, iterations):
+    rng = random.Random(seed)
+    data, num_items, target_verbs, target_connectors = _worker_problem
+    if selected_ids is None:
+        selected_ids = initial_selection(data, num_items, rng)
+    trace = []
+    with instrument.stage('anneal'):
+        selected_ids, score, best_ids, best_score, _ = anneal(data, num_items, target_verbs, target_connectors,
+                                                              selected_ids, GeometricSchedule(temperature, 1.0),
+                                                              iterations, rng=rng, trace=trace)
+    return selected_ids, score, best_ids, best_score, trace, instrument.collect()
+
+def parallel_restarts(data, num_items, target_verbs, target_connectors, num_chains=8, seed=0, processes=None,
+                      initial_temp=100, cooling_rate=0.995, iterations=20000):
+    """Run independent annealing chains in a process pool and return (best_selection, per-chain score traces).
+
+    Each chain gets its own seed drawn from the master seed, so results do not depend on the number of processes.
+    """
+    master = random.Random(seed)
+    chain_seeds = [master.getrandbits(64) for _ in range(num_chains)]
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(data, num_items, target_verbs, target_connectors)) as executor:
+        results = list(executor.map(_run_chain, chain_seeds, [initial_temp] * num_chains,
+                                    [cooling_rate] * num_chains, [iterations] * num_chains))
+
+    for result in results:
+        instrument.merge(result[3])
+    best_ids, _, _, _ = max(results, key=lambda result: result[1])
+    return [data[item_id] for item_id in best_ids], [trace for _, _, trace, _ in results]
+
+def parallel_tempering(data, num_items, target_verbs, target_connectors, temperatures=(100, 30, 10, 3, 1, 0.3),
+                       seed=0, processes=None, rounds=40, iterations_per_round=500):
+    """Run one replica per temperature in a process pool, exchanging states between neighbours after each round.
+
+    Returns (best_selection, per-replica score traces), where trace k follows the replica at temperatures[k].
+    """
+    master = random.Random(seed)
+    states = [None] * len(temperatures)
+    scores = [None] * len(temperatures)
+    traces = [[] for _ in temperatures]
+    best_ids, best_score = None, -math.inf
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(data, num_items, target_verbs, target_connectors)) as executor:
+        for round_num in range(rounds):
+            replica_seeds = [master.getrandbits(64) for _ in temperatures]
+            results = list(executor.map(_run_replica, replica_seeds, states, temperatures,
+                                        [iterations_per_round] * len(temperatures)))
+
+            for k, (selected_ids, score, replica_best_ids, replica_best_score, trace, profile) in enumerate(results):
+                instrument.merge(profile)
+                states[k] = selected_ids
+                scores[k] = score
+                traces[k].extend(trace)
+                if replica_best_score > best_score:
+                    best_ids, best_score = replica_best_ids, replica_best_score
+
+            # Metropolis exchange between neighbouring temperatures, alternating even and odd pairs
+            for k in range(round_num % 2, len(temperatures) - 1, 2):
+                delta = (scores[k + 1] - scores[k]) * (1 / temperatures[k] - 1 / temperatures[k + 1])
+                if delta >= 0 or master.random() < math.exp(delta):
+                    states[k], states[k + 1] = states[k + 1], states[k]
+                    scores[k], scores[k + 1] = scores[k + 1], scores[k]
+
+    return [data[item_id] for item_id in best_ids], traces
+
+class ArrayScorer:
+    """NumPy version of IncrementalScorer that scores a whole batch of candidate swaps in one pass.
+
+    Verbs, connectors and full combinations are integer-encoded once, and the selection is held as count vectors.
+    """
+
+    def __init__(self, data, target_verbs, target_connectors, num_items):
+        verb_ids = {v: i for i, v in enumerate(sorted({item[1] for item in data} | {item[3] for item in data} | set(target_verbs)))}
+        connector_ids = {c: i for i, c in enumerate(sorted({item[2] for item in data} | set(target_connectors)))}
+        combination_ids = {}
+        for item in data:
+            combination_ids.setdefault((item[1], item[2], item[3]), len(combination_ids))
+
+        self.verb1 = np.array([verb_ids[item[1]] for item in data], dtype=np.int64)
+        self.verb2 = np.array([verb_ids[item[3]] for item in data], dtype=np.int64)
+        self.connector = np.array([connector_ids[item[2]] for item in data], dtype=np.int64)
+        self.combination = np.array([combination_ids[(item[1], item[2], item[3])] for item in data], dtype=np.int64)
+
+        self.target_verbs = np.zeros(len(verb_ids))
+        self.has_verb_target = np.zeros(len(verb_ids), dtype=bool)
+        for v, target in target_verbs.items():
+            self.target_verbs[verb_ids[v]] = target
+            self.has_verb_target[verb_ids[v]] = True
+        self.target_connectors = np.zeros(len(connector_ids))
+        self.has_connector_target = np.zeros(len(connector_ids), dtype=bool)
+        for c, target in target_connectors.items():
+            self.target_connectors[connector_ids[c]] = target
+            self.has_connector_target[connector_ids[c]] = True
+
+        self.num_items = num_items
+        self.max_verb_count = num_items * 0.1
+        self.num_verbs = len(verb_ids)
+        self.num_connectors = len(connector_ids)
+        self.num_combinations = len(combination_ids)
+
+    def load(self, selected_ids):
+        """Rebuild the count vectors and the score for a selection of row ids."""
+        selected_ids = np.asarray(selected_ids, dtype=np.int64)
+        self.verb1_counts = np.bincount(self.verb1[selected_ids], minlength=self.num_verbs).astype(np.float64)
+        self.verb2_counts = np.bincount(self.verb2[selected_ids], minlength=self.num_verbs).astype(np.float64)
+        self.verb_counts = self.verb1_counts + self.verb2_counts
+        self.connector_counts = np.bincount(self.connector[selected_ids], minlength=self.num_connectors).astype(np.float64)
+        self.combination_counts = np.bincount(self.combination[selected_ids], minlength=self.num_combinations)
+        self.score = self._score(self._verb_cost(np.arange(self.num_verbs), self.verb_counts, self.verb1_counts,
+                                                 self.verb2_counts).sum(),
+                                 self._connector_cost(np.arange(self.num_connectors), self.connector_counts).sum(),
+                                 np.count_nonzero(self.combination_counts))
+        return self.score
+
+    def _verb_cost(self, verbs, counts, verb1_counts, verb2_counts):
+        target = self.target_verbs[verbs]
+        targeted = (np.minimum(counts, target) - target) ** 2 + (verb1_counts - verb2_counts) ** 2
+        return np.maximum(0, counts - self.max_verb_count) ** 2 * 100 + np.where(self.has_verb_target[verbs], targeted, 0)
+
+    def _connector_cost(self, connectors, counts):
+        cost = (counts - self.target_connectors[connectors]) ** 2 * 2
+        return np.where(self.has_connector_target[connectors], cost, 0)
+
+    def _score(self, verb_cost, connector_cost, unique_combinations):
+        repeat_penalty = self.num_items - unique_combinations
+        return -(verb_cost + connector_cost - unique_combinations * 10 + repeat_penalty * 50)
+
+    def score_swaps(self, remove_ids, add_ids):
+        """Return the score after each swap (remove_ids[k] -> add_ids[k]), all evaluated against the current counts."""
+        remove_ids = np.asarray(remove_ids, dtype=np.int64)
+        add_ids = np.asarray(add_ids, dtype=np.int64)
+
+        # The four verb slots a swap touches, with their (total, verb1, verb2) count changes
+        verbs = np.stack([self.verb1[remove_ids], self.verb2[remove_ids], self.verb1[add_ids], self.verb2[add_ids]], axis=1)
+        slot_deltas = np.array([[-1, -1, 0], [-1, 0, -1], [1, 1, 0], [1, 0, 1]], dtype=np.float64)
+
+        # Merge slots that name the same verb and count each distinct verb once
+        same = verbs[:, :, None] == verbs[:, None, :]
+        merged = same.astype(np.float64) @ slot_deltas
+        first = ~np.any(same & np.tri(4, k=-1, dtype=bool), axis=2)
+
+        counts = self.verb_counts[verbs]
+        verb1_counts = self.verb1_counts[verbs]
+        verb2_counts = self.verb2_counts[verbs]
+        verb_change = (self._verb_cost(verbs, counts + merged[:, :, 0], verb1_counts + merged[:, :, 1],
+                                       verb2_counts + merged[:, :, 2])
+                       - self._verb_cost(verbs, counts, verb1_counts, verb2_counts))
+        verb_change = np.where(first, verb_change, 0).sum(axis=1)
+
+        old_connectors = self.connector[remove_ids]
+        new_connectors = self.connector[add_ids]
+        old_counts = self.connector_counts[old_connectors]
+        new_counts = self.connector_counts[new_connectors]
+        connector_change = np.where(
+            old_connectors == new_connectors, 0,
+            self._connector_cost(old_connectors, old_counts - 1) - self._connector_cost(old_connectors, old_counts)
+            + self._connector_cost(new_connectors, new_counts + 1) - self._connector_cost(new_connectors, new_counts))
+
+        old_combinations = self.combination[remove_ids]
+        new_combinations = self.combination[add_ids]
+        unique_change = np.where(old_combinations == new_combinations, 0,
+                                 (self.combination_counts[new_combinations] == 0).astype(np.int64)
+                                 - (self.combination_counts[old_combinations] == 1))
+
+        # The score is linear in each cost term, so shifting the current score by the changes is exact
+        return self.score - verb_change - connector_change + unique_change * 60
+
+    def apply(self, remove_id, add_id):
+        """Replace remove_id with add_id in the count vectors and return the new score."""
+        self.score = float(self.score_swaps([remove_id], [add_id])[0])
+        self.verb1_counts[self.verb1[remove_id]] -= 1
+        self.verb2_counts[self.verb2[remove_id]] -= 1
+        self.verb_counts[self.verb1[remove_id]] -= 1
+        self.verb_counts[self.verb2[remove_id]] -= 1
+        self.connector_counts[self.connector[remove_id]] -= 1
+        self.combination_counts[self.combination[remove_id]] -= 1
+        self.verb1_counts[self.verb1[add_id]] += 1
+        self.verb2_counts[self.verb2[add_id]] += 1
+        self.verb_counts[self.verb1[add_id]] += 1
+        self.verb_counts[self.verb2[add_id]] += 1
+        self.connector_counts[self.connector[add_id]] += 1
+        self.combination_counts[self.combination[add_id]] += 1
+        return self.score
+
+def batch_search(data, num_items, target_verbs, target_connectors, selected_ids=None, batch_size=256,
+                 initial_temp=100, cooling_rate=0.95, iterations=2000, polish=True, patience=20, seed=None):
+    """Anneal with batched proposals, then optionally run a steepest-descent phase from the best selection.
+
+    Each step scores batch_size random swaps at once. While annealing, the first swap in the batch that passes
+    the Metropolis test is taken, which matches proposing them one at a time. When polishing, the best swap in
+    the batch is taken while it improves the score, stopping after `patience` batches without an improvement.
+    """
+    rng = np.random.default_rng(seed)
+    scorer = ArrayScorer(data, target_verbs, target_connectors, num_items)
+    if selected_ids is None:
+        selected_ids = rng.choice(len(data), size=num_items, replace=False)
+    pool = SelectionPool(len(data), [int(item_id) for item_id in selected_ids])
+    if not pool.unselected:
+        return [data[item_id] for item_id in pool.selected]
+
+    current_score = scorer.load(pool.selected)
+    best_selection = pool.selected[:]
+    best_score = current_score
+    temperature = initial_temp
 
-    return best_selection
+    def propose():
+        remove_slots = rng.integers(0, num_items, size=batch_size)
+        add_slots = rng.integers(0, len(pool.unselected), size=batch_size)
+        selected = np.asarray(pool.selected)
+        unselected = np.asarray(pool.unselected)
+        return remove_slots, add_slots, scorer.score_swaps(selected[remove_slots], unselected[add_slots])
+
+    total_accepted = 0
+    for _ in range(iterations):
+        remove_slots, add_slots, new_scores = propose()
+        with np.errstate(over='ignore'):
+            accepted = (new_scores > current_score) | (rng.random(batch_size) < np.exp((new_scores - current_score) / temperature))
+        if accepted.any():
+            total_accepted += 1
+            k = int(np.argmax(accepted))
+            current_score = scorer.apply(pool.selected[remove_slots[k]], pool.unselected[add_slots[k]])
+            pool.swap(int(remove_slots[k]), int(add_slots[k]))
+            if current_score > best_score:
+                best_selection = pool.selected[:]
+                best_score = current_score
+        temperature *= cooling_rate
+    instrument.count('batch_steps', iterations)
+    instrument.count('batch_swaps_scored', iterations * batch_size)
+    instrument.count('batch_accepted', total_accepted)
+
+    if polish:
+        pool = SelectionPool(len(data), best_selection)
+        current_score = scorer.load(pool.selected)
+        stale = 0
+        while stale < patience:
+            remove_slots, add_slots, new_scores = propose()
+            k = int(np.argmax(new_scores))
+            if new_scores[k] > current_score:
+                current_score = scorer.apply(pool.selected[remove_slots[k]], pool.unselected[add_slots[k]])
+                pool.swap(int(remove_slots[k]), int(add_slots[k]))
+                stale = 0
+            else:
+                stale += 1
+        if current_score > best_score:
+            best_selection = pool.selected[:]
+
+    return [data[item_id] for item_id in best_selection]
 
 def write_results_to_csv(optimized_items, filename):
     with open(filename, 'w', newline='') as f:
@@ -142,17 +728,61 @@ def print_statistics(selection, target_verbs, target_connectors, num_items):
     else:
         print("\nNo verbs exceed the 10% limit.")
 
-def main():
-    data = load_data('items2.csv')
-    num_items = 250
+def optimize_file(input_file, output_file, num_items=250, mode='single', seed=None, chains=8, processes=None,
+                  schedule='geometric', patience=None, checkpoint_path=None, resume=False):
+    """Select num_items balanced items from an item CSV with the given search mode and write them to output_file."""
+    # Verbs and connectors are interned to integer ids, so the search compares and counts ints, not strings
+    with instrument.stage('load_items'):
+        store = load_items(input_file)
+    data = store.rows()
 
     verbs, connectors = count_verbs_and_connectors(data)
     target_verbs, target_connectors = calculate_target_distribution(verbs, connectors, num_items)
 
-    optimized_items = simulated_annealing(data, num_items, target_verbs, target_connectors)
+    if mode == 'restarts':
+        optimized_items, _ = parallel_restarts(data, num_items, target_verbs, target_connectors, num_chains=chains,
+                                               seed=seed, processes=processes)
+    elif mode == 'tempering':
+        optimized_items, _ = parallel_tempering(data, num_items, target_verbs, target_connectors,
+                                                seed=seed, processes=processes)
+    elif mode == 'batch':
+        with instrument.stage('batch_search'):
+            optimized_items = batch_search(data, num_items, target_verbs, target_connectors, seed=seed)
+    else:
+        rng = random.Random(seed) if seed is not None else random
+        optimized_items = simulated_annealing(data, num_items, target_verbs, target_connectors, rng=rng,
+                                              schedule=schedule, patience=patience, progress=print_progress,
+                                              checkpoint_path=checkpoint_path, resume=resume)
+
+    optimized_items = store.decode_rows(optimized_items)
+    write_results_to_csv(optimized_items, output_file)
+    print_statistics(optimized_items, store.decode_keys(target_verbs), store.decode_keys(target_connectors), num_items)
+    return optimized_items
 
-    write_results_to_csv(optimized_items, 'optimized_items_full_uniqueness.csv')
-    print_statistics(optimized_items, target_verbs, target_connectors, num_items)
+def main():
+    parser = argparse.ArgumentParser(description="Select a balanced subset of items by simulated annealing.")
+    parser.add_argument('--mode', choices=['single', 'restarts', 'tempering', 'batch'], default='single',
+                        help="single chain, independent parallel restarts, parallel tempering, or the NumPy batch engine")
+    parser.add_argument('--chains', type=int, default=8, help="number of chains for --mode restarts")
+    parser.add_argument('--seed', type=int, default=None, help="master seed for reproducible runs")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--schedule', choices=['geometric', 'adaptive'], default='geometric',
+                        help="cooling schedule for --mode single")
+    parser.add_argument('--patience', type=int, default=None,
+                        help="stop once the best score has not improved for this many iterations of a frozen chain")
+    parser.add_argument('--checkpoint', default=None, help="file to save the chain state to periodically")
+    parser.add_argument('--resume', action='store_true', help="continue from --checkpoint if it exists")
+    parser.add_argument('--profile', default=None,
+                        help="record stage timings and counters and write them to this JSON/Chrome trace file")
+    args = parser.parse_args()
+    if args.profile:
+        instrument.enable()
+
+    optimize_file('items2.csv', 'optimized_items_full_uniqueness.csv', mode=args.mode, seed=args.seed,
+                  chains=args.chains, processes=args.processes, schedule=args.schedule, patience=args.patience,
+                  checkpoint_path=args.checkpoint, resume=args.resume)
+    if args.profile:
+        instrument.write_profile(args.profile)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
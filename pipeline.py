@@ -0,0 +1,258 @@
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import ajtconvert
+import instrument
+import item_randomize
+import itemstore
+import optimize_items
+import stimgen
+import validate
+from itemstore import file_hash
+
+CACHE_DIR = '.pipeline_cache'
+VALIDATION_REPORT = 'validation_report.csv'
+
+class Stage:
+    """One step of the pipeline: func(inputs, outputs, **params, **options) reads the input files and writes the outputs.
+
+    The cache key covers the contents of the inputs, the params and the source of the modules in code, so a stage
+    reruns only when one of those changes. options (such as worker counts) do not change the outputs and are
+    left out of the key.
+    """
+
+    def __init__(self, name, func, inputs, outputs, params=None, code=(), options=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.code = list(code)
+        self.options = options or {}
+
+    def key(self, input_hashes):
+        description = {'name': self.name, 'func': self.func.__name__, 'params': self.params,
+                       'inputs': input_hashes, 'outputs': [os.path.basename(output) for output in self.outputs],
+                       'code': [file_hash(module.__file__) for module in self.code]}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+# Stage functions run in worker processes, so they are module-level and take plain file names
+
+def run_optimize(inputs, outputs, num_items, mode, seed, chains, processes=None):
+    optimize_items.optimize_file(inputs[0], outputs[0], num_items=num_items, mode=mode, seed=seed, chains=chains,
+                                 processes=processes)
+
+def run_distribute(inputs, outputs, min_distances, seed):
+    item_randomize.distribute_file(inputs[0], outputs[0], min_distances, seed=seed)
+
+def run_stimuli_list(inputs, outputs, assignment_file, list_num, conditions, seed):
+    # conditions only keys the cache on this list's column; the column itself is read from assignment_file
+    items_file, translations_file = inputs
+    assignments, items, lexicon = stimgen.load_inputs(items_file, assignment_file, translations_file)
+    rows = stimgen.list_tuples(stimgen.assignment_rows(assignments[['Item:', list_num]], items)).get(list_num, [])
+    stimgen.write_stimuli(stimgen.generate_list(list_num, rows, lexicon, seed), outputs[0])
+
+def run_validate(inputs, outputs):
+    items_file, translations_file, *list_files = inputs
+    validate.validate_files(list_files, items_file, translations_file, report_file=outputs[0])
+
+def run_ajt(inputs, outputs, assignment_file, list_num, conditions, seed):
+    # As in run_stimuli_list, conditions keys the cache; the schedule is rebuilt from assignment_file
+    ajtconvert.transform_excel(inputs[0], outputs[0], ajtconvert.schedule_pairs(assignment_file, list_num, seed))
+
+def _execute(func, name, inputs, outputs, params, options):
+    with instrument.stage(name):
+        func(inputs, outputs, **params, **options)
+    return instrument.collect()
+
+def assignment_columns(assignment_file):
+    """Return {list name: SHA-256 of its (item, condition) pairs}, so each list is keyed on its own column."""
+    with open(assignment_file, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+    digests = {}
+    for index, list_num in enumerate(header[1:], start=1):
+        pairs = [(row[0], row[index]) for row in rows]
+        digests[list_num] = hashlib.sha256(json.dumps(pairs).encode()).hexdigest()
+    return digests
+
+def build_stages(items_file='items2.csv', assignment_file='item_assignment.csv', translations_file='translations.csv',
+                 output_dir='.', num_items=250, mode='single', seed=0, chains=8, min_distances=None, processes=None):
+    """Model the item-to-AJT workflow as stages: one stimulus list and one AJT stage per list, and a validation
+    stage over all the lists."""
+    def path(name):
+        return os.path.join(output_dir, name)
+
+    optimized = path('optimized_items_full_uniqueness.csv')
+    distributed = path('guaranteed_completion_distributed_items.csv')
+    stages = [
+        Stage('optimize', run_optimize, [items_file], [optimized],
+              params={'num_items': num_items, 'mode': mode, 'seed': seed, 'chains': chains},
+              code=[optimize_items, itemstore], options={'processes': processes}),
+        Stage('distribute', run_distribute, [optimized], [distributed],
+              params={'min_distances': min_distances or {'connector': 2}, 'seed': seed},
+              code=[item_randomize, itemstore]),
+    ]
+    list_files = []
+    for list_num, conditions in assignment_columns(assignment_file).items():
+        stimuli = path(f"stimuli_list_{list_num}.xlsx")
+        list_files.append(stimuli)
+        stages.append(Stage(f"stimuli {list_num}", run_stimuli_list, [distributed, translations_file], [stimuli],
+                            params={'assignment_file': assignment_file, 'list_num': list_num,
+                                    'conditions': conditions, 'seed': seed},
+                            code=[stimgen, itemstore]))
+        stages.append(Stage(f"ajt {list_num}", run_ajt, [stimuli], [path(f"AJT{list_num}.xlsx")],
+                            params={'assignment_file': assignment_file, 'list_num': list_num,
+                                    'conditions': conditions, 'seed': seed},
+                            code=[ajtconvert, stimgen]))
+    stages.append(Stage('validate', run_validate, [distributed, translations_file, *list_files],
+                        [path(VALIDATION_REPORT)], code=[validate, stimgen]))
+    return stages
+
+def copy_if_changed(source, destination, sha256):
+    """Copy a cached output into place unless the destination already has the same contents."""
+    if os.path.exists(destination) and file_hash(destination) == sha256:
+        return
+    tmp_destination = destination + '.tmp'
+    shutil.copyfile(source, tmp_destination)
+    os.replace(tmp_destination, destination)
+
+def load_cached(cache_dir, key):
+    manifest_file = os.path.join(cache_dir, key, 'outputs.json')
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+def store_outputs(cache_dir, key, staging_dir, stage):
+    """Move a stage's staged outputs into the cache under its key and record their hashes."""
+    manifest = {os.path.basename(output): file_hash(os.path.join(staging_dir, os.path.basename(output)))
+                for output in stage.outputs}
+    with open(os.path.join(staging_dir, 'outputs.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    entry = os.path.join(cache_dir, key)
+    if os.path.exists(entry):
+        shutil.rmtree(entry)  # An incomplete entry left by an interrupted run
+    os.replace(staging_dir, entry)
+    return manifest
+
+def run_pipeline(stages, cache_dir=CACHE_DIR, processes=None, force=False):
+    """Run the stages in dependency order, reusing cached outputs for stages whose key is unchanged.
+
+    Stages that are ready at the same time (e.g. the per-list branches) run concurrently in a process pool; a
+    stage that is the only one ready runs in this process, so it can start a pool of its own. Returns
+    {stage name: 'ran' or 'cached'}.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    producers = {output: stage for stage in stages for output in stage.outputs}
+    dependencies = {stage.name: {producers[i].name for i in stage.inputs if i in producers} for stage in stages}
+    hashes = {}  # file name -> SHA-256, filled in as sources are read and stages finish
+    status = {}
+    pending = list(stages)
+    running = {}
+
+    def input_hash(filename):
+        if filename not in hashes:
+            hashes[filename] = file_hash(filename)
+        return hashes[filename]
+
+    def finish(stage, key, manifest, outcome):
+        entry = os.path.join(cache_dir, key)
+        for output in stage.outputs:
+            name = os.path.basename(output)
+            copy_if_changed(os.path.join(entry, name), output, manifest[name])
+            hashes[output] = manifest[name]
+        status[stage.name] = outcome
+        print(f"{stage.name}: {outcome}")
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        while pending or running:
+            ready = [stage for stage in pending if dependencies[stage.name] <= status.keys()]
+            if not ready and not running:
+                raise RuntimeError(f"Stages {[stage.name for stage in pending]} have unmet dependencies")
+            progressed = False
+            for stage in ready:
+                pending.remove(stage)
+                key = stage.key([input_hash(filename) for filename in stage.inputs])
+                manifest = None if force else load_cached(cache_dir, key)
+                if manifest is not None:
+                    finish(stage, key, manifest, 'cached')
+                    progressed = True
+                    continue
+                staging_dir = tempfile.mkdtemp(dir=cache_dir, prefix='staging-')
+                staged = [os.path.join(staging_dir, os.path.basename(output)) for output in stage.outputs]
+                args = (stage.func, stage.name, stage.inputs, staged, stage.params, stage.options)
+                if len(ready) == 1 and not running:
+                    instrument.merge(_execute(*args))
+                    finish(stage, key, store_outputs(cache_dir, key, staging_dir, stage), 'ran')
+                    progressed = True
+                else:
+                    running[executor.submit(_execute, *args)] = (stage, key, staging_dir)
+            if progressed or not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, key, staging_dir = running.pop(future)
+                try:
+                    instrument.merge(future.result())
+                except Exception:
+                    shutil.rmtree(staging_dir, ignore_errors=True)
+                    raise
+                finish(stage, key, store_outputs(cache_dir, key, staging_dir, stage), 'ran')
+    return status
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the items-to-AJT workflow, rerunning only stages whose inputs changed.")
+    parser.add_argument('--items', default='items2.csv', help="item bank to select from")
+    parser.add_argument('--assignment', default='item_assignment.csv', help="item-by-list condition matrix")
+    parser.add_argument('--translations', default='translations.csv', help="English-French translation table")
+    parser.add_argument('--output-dir', default='.', help="directory for the intermediate and final files")
+    parser.add_argument('--num-items', type=int, default=250, help="number of items to select")
+    parser.add_argument('--mode', choices=['single', 'restarts', 'tempering', 'batch'], default='single',
+                        help="optimize_items search mode")
+    parser.add_argument('--chains', type=int, default=8, help="number of chains for --mode restarts")
+    parser.add_argument('--min-distance', type=item_randomize.parse_min_distance, action='append', default=None,
+                        metavar='COLUMN=N', help="minimum distance between repeats of a column (default: connector=2)")
+    parser.add_argument('--seed', type=int, default=0, help="master seed for every stage (results are cached per seed)")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="directory holding cached stage outputs")
+    parser.add_argument('--force', action='store_true', help="rerun every stage regardless of the cache")
+    parser.add_argument('--allow-violations', action='store_true',
+                        help="exit successfully even when stimulus validation reports violations")
+    parser.add_argument('--profile', default=None,
+                        help="record stage timings and counters and write them to this JSON/Chrome trace file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.profile:
+        instrument.enable()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    stages = build_stages(args.items, args.assignment, args.translations, output_dir=args.output_dir,
+                          num_items=args.num_items, mode=args.mode, seed=args.seed, chains=args.chains,
+                          min_distances=dict(args.min_distance) if args.min_distance else None,
+                          processes=args.processes)
+    status = run_pipeline(stages, cache_dir=args.cache_dir, processes=args.processes, force=args.force)
+    ran = sum(outcome == 'ran' for outcome in status.values())
+    print(f"Ran {ran} of {len(status)} stages ({len(status) - ran} from cache)")
+    if args.profile:
+        instrument.write_profile(args.profile)
+
+    # The stimulus checks gate the run: violations make it exit non-zero, with the details in the report
+    report_file = os.path.join(args.output_dir, VALIDATION_REPORT)
+    with open(report_file, 'r') as f:
+        violations = sum(1 for _ in f) - 1
+    if violations > 0 and not args.allow_violations:
+        print(f"Validation found {violations} violations; see {report_file}")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
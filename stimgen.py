@@ -1,87 +1,132 @@
 import pandas as pd
+import argparse
+import csv
+import os
 import random
 import logging
-from typing import List, Tuple
+from functools import lru_cache
+from itertools import chain, combinations, islice
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment, PatternFill
-from collections import Counter
+from openpyxl.utils import get_column_letter
+from concurrent.futures import ProcessPoolExecutor
+from ajtconvert import write_ajt_file
+from itemstore import load_items
+from assignment import build_assignments
+import instrument
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# Logging is configured by main(), so importing this module does not turn on debug output for the caller.
+# Debug messages use %-style arguments and are only formatted when debug logging is on.
 logger = logging.getLogger(__name__)
 
-character_counter = Counter()
-
 def load_csv(filename: str) -> pd.DataFrame:
     """Load a CSV file and return a pandas DataFrame."""
     try:
-        df = pd.read_csv(filename)
+        with instrument.stage('load_csv'):
+            df = pd.read_csv(filename)
         logger.info(f"Successfully loaded {filename}")
-        logger.debug(f"Columns in {filename}: {df.columns.tolist()}")
-        logger.debug(f"First few rows of {filename}:\n{df.head().to_string()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Columns in %s: %s", filename, df.columns.tolist())
+            logger.debug("First few rows of %s:\n%s", filename, df.head().to_string())
         return df
     except Exception as e:
         logger.error(f"Error loading {filename}: {str(e)}")
         raise
 
-def get_combination(item_num: int, characters: List[str], language: str) -> str:
-    """Get a balanced combination of two characters for each item, with Alex first if included."""
-    global character_counter
-    
-    if len(character_counter) == 0:  # Initialize counter if it's empty
-        character_counter = Counter({char: 0 for char in characters})
-    
-    # Sort characters by usage count
-    sorted_chars = sorted(characters, key=lambda x: (character_counter[x], random.random()))
-    
-    # Select the two least used characters
-    selected = sorted_chars[:2]
-    
-    # Update counter
-    character_counter.update(selected)
-    
-    # Ensure Alex is first if selected
-    if "Alex" in selected:
-        selected.remove("Alex")
-        selected = ["Alex"] + selected
-    
-    return f"{selected[0]} {'et' if language == 'French' else 'and'} {selected[1]}"
+CHARACTERS = ["Jennifer", "George", "Alex"]
+PLURAL_CONDITIONS = (7, 8, 15, 16)
+
+def character_pairs(characters: List[str]) -> List[Tuple[str, str]]:
+    """Every pair of characters, with Alex first if included."""
+    return [tuple(sorted(pair, key=lambda char: char != "Alex")) for pair in combinations(characters, 2)]
+
+def build_pair_schedule(conditions: Sequence[int], rng: random.Random) -> List[Optional[Tuple[str, str]]]:
+    """Assign a character pair to every plural-condition position of a list, None elsewhere.
 
-def get_pronoun(condition: int, language: str) -> str:
+    Within each plural condition every pair is used equally often (give or take one), and the leftover pairs
+    rotate across conditions so the list as a whole stays balanced as well.
+    """
+    pairs = character_pairs(CHARACTERS)
+    leftover_order = rng.sample(pairs, len(pairs))
+    leftovers = 0
+    sequences = {}
+    for condition in PLURAL_CONDITIONS:
+        count = sum(1 for c in conditions if c == condition)
+        sequence = pairs * (count // len(pairs))
+        for _ in range(count % len(pairs)):
+            sequence.append(leftover_order[leftovers % len(pairs)])
+            leftovers += 1
+        rng.shuffle(sequence)
+        sequences[condition] = iter(sequence)
+
+    schedule = []
+    for condition in conditions:
+        if condition not in sequences:
+            schedule.append(None)
+            continue
+        pair = next(sequences[condition])
+        # Pairs without Alex have no fixed order
+        if pair[0] != "Alex" and rng.random() < 0.5:
+            pair = pair[::-1]
+        schedule.append(pair)
+    return schedule
+
+@lru_cache(maxsize=None)
+def list_pair_schedule(list_num: str, conditions: Tuple[int, ...], seed: int) -> Tuple[Optional[Tuple[str, str]], ...]:
+    """Return the cached, seeded character pair schedule for one list's assignment column."""
+    return tuple(build_pair_schedule(conditions, random.Random(f"{seed}:{list_num}:pairs")))
+
+def item_pairs(list_num: str, items: Sequence[int], conditions: Sequence[int], seed: int) -> Dict[int, Tuple[str, str]]:
+    """Map each plural-condition item of a list to its scheduled character pair.
+
+    items and conditions are the list's assignment column in file order, as generate_list_records sees it.
+    """
+    schedule = list_pair_schedule(list_num, tuple(int(c) for c in conditions), seed)
+    return {int(item): pair for item, pair in zip(items, schedule) if pair is not None}
+
+# Pronoun(s) and subject of every condition; a list of pronouns means one is chosen at random
+CONDITION_PRONOUNS = {
+    "French": {1: "elle", 2: "il", 3: "il", 4: "elle", 5: "iel", 6: ["il", "elle"], 7: "iel", 8: ["il", "elle"]},
+    "English": {9: "she", 10: "he", 11: "he", 12: "she", 13: "they", 14: ["he", "she"], 15: "they", 16: ["he", "she"]}
+}
+SUBJECTS = {1: "Jennifer", 2: "Jennifer", 3: "George", 4: "George", 5: "Alex", 6: "Alex",
+            9: "Jennifer", 10: "Jennifer", 11: "George", 12: "George", 13: "Alex", 14: "Alex"}
+
+def get_pronoun(condition: int, language: str, rng: random.Random = random) -> str:
     """Get the appropriate pronoun based on the condition and language."""
-    pronouns = {
-        "French": {1: "elle", 2: "il", 3: "il", 4: "elle", 5: "iel", 6: ["il", "elle"], 7: "iel", 8: ["il", "elle"]},
-        "English": {9: "she", 10: "he", 11: "he", 12: "she", 13: "they", 14: ["he", "she"], 15: "they", 16: ["he", "she"]}
-    }
-    pronoun = pronouns[language][condition]
+    pronoun = CONDITION_PRONOUNS[language][condition]
     if isinstance(pronoun, list):
-        pronoun = random.choice(pronoun)
+        pronoun = rng.choice(pronoun)
     return pronoun
 
 def get_subject(condition: int) -> str:
     """Get the appropriate subject based on the condition."""
-    subjects = {1: "Jennifer", 2: "Jennifer", 3: "George", 4: "George", 5: "Alex", 6: "Alex",
-                9: "Jennifer", 10: "Jennifer", 11: "George", 12: "George", 13: "Alex", 14: "Alex"}
-    return subjects.get(condition, None)
+    return SUBJECTS.get(condition, None)
 
-def get_french_translation(word: str, translations: pd.DataFrame) -> str:
-    """Get the French translation of a word."""
+def find_translation(word: str, table: Mapping[str, str]) -> Optional[str]:
+    """Look up a word, falling back to its -s and -es stems; return None if there is no translation."""
     if word == "cooks":
         return "cuisine"
-    if word in translations.index:
-        return translations.loc[word, translations.columns[0]]
-    elif word.endswith('s') and word[:-1] in translations.index:
-        return translations.loc[word[:-1], translations.columns[0]]
-    elif word.endswith('es') and word[:-2] in translations.index:
-        return translations.loc[word[:-2], translations.columns[0]]
-    logger.warning(f"No translation found for word: {word}")
-    return word
+    if word in table:
+        return table[word]
+    elif word.endswith('s') and word[:-1] in table:
+        return table[word[:-1]]
+    elif word.endswith('es') and word[:-2] in table:
+        return table[word[:-2]]
+    return None
 
-def translate_and_conjugate_french(verb: str, translations: pd.DataFrame, plural: bool) -> str:
-    """Translate an English verb to French and conjugate it."""
-    logger.debug(f"Translating verb: {verb}")
-    french_verb = get_french_translation(verb, translations)
-    logger.debug(f"French translation: {french_verb}")
+def get_french_translation(word: str, translations: pd.DataFrame) -> str:
+    """Get the French translation of a word."""
+    french = find_translation(word, translations[translations.columns[0]])
+    if french is None:
+        logger.warning(f"No translation found for word: {word}")
+        return word
+    return french
+
+def conjugate_french(french_verb: str, plural: bool) -> str:
+    """Conjugate a French verb for a singular or plural subject."""
     if plural:
         if french_verb == "cuisine":
             return "cuisinent"
@@ -93,6 +138,13 @@ def translate_and_conjugate_french(verb: str, translations: pd.DataFrame, plural
             return french_verb + 'ent'
     return french_verb
 
+def translate_and_conjugate_french(verb: str, translations: pd.DataFrame, plural: bool) -> str:
+    """Translate an English verb to French and conjugate it."""
+    logger.debug("Translating verb: %s", verb)
+    french_verb = get_french_translation(verb, translations)
+    logger.debug("French translation: %s", french_verb)
+    return conjugate_french(french_verb, plural)
+
 def get_base_form(verb: str) -> str:
     """Get the base form of a verb, considering it might be in third-person singular."""
     if verb.endswith('ies'):
@@ -136,105 +188,305 @@ def correct_verb_spelling(verb: str) -> str:
     }
     return corrections.get(verb, verb)
 
-def generate_stimulus(item: pd.Series, condition: int, translations: pd.DataFrame) -> str:
-    """Generate a stimulus based on the item, condition, and translations."""
+class Lexicon:
+    """French translations and English/French conjugations of the item words, computed once up front."""
+
+    def __init__(self, translations: pd.DataFrame, words: Iterable[str] = ()):
+        self.table = translations[translations.columns[0]].to_dict()
+        self.french = {}
+        self.french_plural = {}
+        self.english_singular = {}
+        self.english_base = {}
+        self.missing = set()
+        for word in words:
+            self.add(word)
+        if self.missing:
+            logger.warning(f"No translation found for {len(self.missing)} words: {', '.join(sorted(self.missing))}")
+
+    def add(self, word: str):
+        french = find_translation(word, self.table)
+        if french is None:
+            self.missing.add(word)
+            instrument.count('translation_misses')
+            french = word
+        self.french[word] = french
+        self.french_plural[word] = conjugate_french(french, True)
+        self.english_singular[word] = correct_verb_spelling(conjugate_english(word, True))
+        self.english_base[word] = correct_verb_spelling(get_base_form(word))
+
+    def _ensure(self, word: str):
+        # Words outside the prebuilt set are added on first use, so each missing translation is reported once
+        if word not in self.french:
+            self.add(word)
+            if word in self.missing:
+                logger.warning(f"No translation found for word: {word}")
+
+    def french_verb(self, word: str, plural: bool) -> str:
+        self._ensure(word)
+        return self.french_plural[word] if plural else self.french[word]
+
+    def french_word(self, word: str) -> str:
+        self._ensure(word)
+        return self.french[word]
+
+    def english_verb(self, word: str, singular: bool) -> str:
+        self._ensure(word)
+        return self.english_singular[word] if singular else self.english_base[word]
+
+class StimulusRecord(NamedTuple):
+    """A generated stimulus kept in structured form: its tokens, where the pronoun is and who the subject is."""
+    item_num: int
+    condition: int
+    tokens: Tuple[str, ...]
+    pronoun_index: int
+    characters: Tuple[str, ...]
+
+    @property
+    def text(self) -> str:
+        return ' '.join(self.tokens) + '.'
+
+def build_stimulus(item_num: int, verb1: str, connector: str, verb2: str, condition: int, lexicon: Lexicon,
+                   rng: random.Random, pair: Optional[Tuple[str, str]] = None) -> StimulusRecord:
+    """Build a stimulus from an item's plain word fields, the condition and lexicon.
+
+    Plural conditions take their character pair from the list's schedule (see list_pair_schedule).
+    """
     language = "French" if condition <= 8 else "English"
-    characters = ["Jennifer", "George", "Alex"]
     
-    is_plural = condition in [7, 8, 15, 16]
-    subject = get_combination(item.name, characters, language) if is_plural else get_subject(condition)
-    pronoun = get_pronoun(condition, language)
+    is_plural = condition in PLURAL_CONDITIONS
+    if is_plural:
+        if pair is None:
+            raise ValueError(f"Condition {condition} needs a character pair")
+        characters = tuple(pair)
+        subject = [characters[0], 'et' if language == 'French' else 'and', characters[1]]
+    else:
+        characters = (get_subject(condition),)
+        subject = [characters[0]]
+    pronoun = get_pronoun(condition, language, rng)
     
     try:
         if language == "French":
-            verb1 = translate_and_conjugate_french(item['verb1'], translations, is_plural)
-            verb2 = translate_and_conjugate_french(item['verb2'], translations, is_plural)
-            connector = get_french_translation(item['connector'], translations)
+            verb1 = lexicon.french_verb(verb1, is_plural)
+            verb2 = lexicon.french_verb(verb2, is_plural)
+            connector = lexicon.french_word(connector)
         else:
             is_plural_or_they = is_plural or condition == 13
-            verb1 = correct_verb_spelling(conjugate_english(item['verb1'], not is_plural))
-            verb2 = correct_verb_spelling(get_base_form(item['verb2']) if is_plural_or_they else conjugate_english(item['verb2'], True))
-            connector = item['connector']
+            verb1 = lexicon.english_verb(verb1, not is_plural)
+            verb2 = lexicon.english_verb(verb2, not is_plural_or_they)
         
-        return f"{subject} {verb1} {connector} {pronoun} {verb2}."
+        before_pronoun = subject + verb1.split() + connector.split()
+        tokens = tuple(before_pronoun + [pronoun] + verb2.split())
+        return StimulusRecord(item_num, condition, tokens, len(before_pronoun), characters)
     except Exception as e:
-        logger.error(f"Error in generate_stimulus: {str(e)}")
-        logger.debug(f"Item: {item.to_dict()}, Condition: {condition}")
+        logger.error(f"Error in build_stimulus: {str(e)}")
+        logger.debug("Item: %s, Condition: %s", (item_num, verb1, connector, verb2), condition)
         raise
 
-def create_excel_file(stimuli: List[Tuple[int, int, str]], filename: str):
-    """Create an Excel file with the stimuli."""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Stimuli"
+def generate_stimulus(item: pd.Series, condition: int, lexicon: Lexicon, rng: random.Random,
+                      pair: Optional[Tuple[str, str]] = None) -> StimulusRecord:
+    """Generate a stimulus based on the item, condition, lexicon and scheduled character pair."""
+    return build_stimulus(item.name, item['verb1'], item['connector'], item['verb2'], condition, lexicon, rng, pair)
 
-    # Add headers
+def create_excel_file(stimuli: Iterable[Tuple[int, int, str]], filename: str, width_sample: int = 1000):
+    """Stream the stimuli into a write-only Excel workbook with a styled header."""
     headers = ['Item Number', 'Condition Number', 'Stimulus']
-    for col, header in enumerate(headers, start=1):
-        cell = ws.cell(row=1, column=col, value=header)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Stimuli")
+
+    # Write-only sheets emit column widths before the first row, so widths are measured over the first
+    # width_sample rows (a whole list in practice) and the rest of the rows are streamed straight through.
+    rows = iter(stimuli)
+    buffered = list(islice(rows, width_sample))
+    widths = [len(header) for header in headers]
+    for row in buffered:
+        widths = [max(width, len(str(value))) for width, value in zip(widths, row)]
+    for col, width in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(col)].width = width + 2
+
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
         cell.font = Font(bold=True)
         cell.alignment = Alignment(horizontal='center')
         cell.fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
+        header_cells.append(cell)
+    ws.append(header_cells)
 
-    # Add data
-    for row, (item_num, condition, stimulus) in enumerate(stimuli, start=2):
-        ws.cell(row=row, column=1, value=item_num)
-        ws.cell(row=row, column=2, value=condition)
-        ws.cell(row=row, column=3, value=stimulus)
-
-    # Adjust column widths
-    for column_cells in ws.columns:
-        length = max(len(str(cell.value)) for cell in column_cells)
-        ws.column_dimensions[column_cells[0].column_letter].width = length + 2
+    for row in chain(buffered, rows):
+        ws.append(list(row))
 
-    # Save the workbook
     wb.save(filename)
+    instrument.count('excel_bytes_written', os.path.getsize(filename))
+    logger.info(f"Saved {filename}")
+
+def create_csv_file(stimuli: Iterable[Tuple[int, int, str]], filename: str):
+    """Stream the stimuli into a plain CSV file without styling."""
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Item Number', 'Condition Number', 'Stimulus'])
+        writer.writerows(stimuli)
     logger.info(f"Saved {filename}")
 
+def create_parquet_file(stimuli: Iterable[Tuple[int, int, str]], filename: str):
+    """Write the stimuli to a Parquet file (requires pyarrow or fastparquet)."""
+    df = pd.DataFrame(list(stimuli), columns=['Item Number', 'Condition Number', 'Stimulus'])
+    df.to_parquet(filename, index=False)
+    logger.info(f"Saved {filename}")
+
+def write_stimuli(stimuli: Iterable[Tuple[int, int, str]], filename: str):
+    """Write the stimuli in the format given by the file extension (.xlsx, .csv or .parquet)."""
+    writers = {'.xlsx': create_excel_file, '.csv': create_csv_file, '.parquet': create_parquet_file}
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in writers:
+        raise ValueError(f"Unsupported output format: {filename}")
+    with instrument.stage('write_stimuli'):
+        writers[extension](stimuli, filename)
+
+def list_rng(seed: int, list_num: str) -> random.Random:
+    """Return the RNG stream for one list, derived from the master seed and the list name only."""
+    return random.Random(f"{seed}:{list_num}")
+
+def assignment_rows(assignments: pd.DataFrame, items: pd.DataFrame) -> pd.DataFrame:
+    """Melt the assignment matrix into long (List, Item:, Condition) rows joined once to the item words.
+
+    Item numbers refer to rows of items.csv starting from 1. Rows keep the list order of the assignment columns
+    and the item order within each list.
+    """
+    long = assignments.melt(id_vars='Item:', var_name='List', value_name='Condition')
+    item_words = items[['verb1', 'connector', 'verb2']].assign(**{'Item:': range(1, len(items) + 1)})
+    return long.merge(item_words, on='Item:', how='left', validate='many_to_one')
+
+def list_tuples(rows: pd.DataFrame) -> dict:
+    """Split joined assignment rows into plain (item, condition, verb1, connector, verb2) tuples per list."""
+    columns = [rows[name].tolist() for name in ['Item:', 'Condition', 'verb1', 'connector', 'verb2']]
+    per_list = {}
+    for list_num, *row in zip(rows['List'].tolist(), *columns):
+        per_list.setdefault(list_num, []).append(tuple(row))
+    return per_list
+
+def generate_list_records(list_num: str, rows: Iterable[Tuple[int, int, str, str, str]], lexicon: Lexicon,
+                          seed: int) -> List[StimulusRecord]:
+    """Generate the stimulus records for one list with its own RNG stream and character pair schedule."""
+    rows = list(rows)
+    rng = list_rng(seed, list_num)
+    pairs = list_pair_schedule(list_num, tuple(int(row[1]) for row in rows), seed)
+    records = []
+    with instrument.stage('generate_list'):
+        for (item_num, condition, verb1, connector, verb2), pair in zip(rows, pairs):
+            try:
+                if pd.isna(verb1):
+                    raise IndexError(f"no row for item {item_num} in the items table")
+                records.append(build_stimulus(item_num, verb1, connector, verb2, condition, lexicon, rng, pair))
+            except Exception as e:
+                instrument.count('stimulus_errors')
+                logger.error(f"Error generating stimulus for item {item_num} in List {list_num}: {str(e)}")
+    instrument.count('rows_generated', len(records))
+    return records
+
+def generate_list(list_num: str, rows: Iterable[Tuple[int, int, str, str, str]], lexicon: Lexicon,
+                  seed: int) -> List[Tuple[int, int, str]]:
+    """Generate the (item, condition, stimulus) rows for one list."""
+    return [(record.item_num, record.condition, record.text)
+            for record in generate_list_records(list_num, rows, lexicon, seed)]
+
+_worker_lexicon = None
+
+def _init_worker(lexicon: Lexicon):
+    global _worker_lexicon
+    _worker_lexicon = lexicon
+
+def _generate_list_file(list_num: str, rows: List[Tuple[int, int, str, str, str]], seed: int,
+                        output_filename: str, ajt: bool = False) -> Tuple[str, Optional[dict]]:
+    logger.info(f"Generating stimuli for List {list_num}")
+    if ajt:
+        # Build the AJT rows straight from the records, skipping the stimulus workbook round trip
+        write_ajt_file(generate_list_records(list_num, rows, _worker_lexicon, seed), output_filename)
+    else:
+        write_stimuli(generate_list(list_num, rows, _worker_lexicon, seed), output_filename)
+    return output_filename, instrument.collect()
+
+def generate_all_lists(assignments: pd.DataFrame, items: pd.DataFrame, lexicon: Lexicon, seed: int,
+                       processes: Optional[int] = None, output_pattern: Optional[str] = None,
+                       ajt: bool = False) -> List[str]:
+    """Generate and write every list in a process pool; output for a seed does not depend on the worker count.
+
+    With ajt=True each list is written directly as an AJT workbook instead of a stimulus list.
+    """
+    if output_pattern is None:
+        output_pattern = 'AJT{}.xlsx' if ajt else 'stimuli_list_{}.xlsx'
+    per_list = list_tuples(assignment_rows(assignments, items))
+    list_nums = list(assignments.columns[1:])
+    filenames = [output_pattern.format(list_num) for list_num in list_nums]
+    written = []
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(lexicon,)) as executor:
+        for filename, profile in executor.map(_generate_list_file, list_nums,
+                                              [per_list.get(list_num, []) for list_num in list_nums],
+                                              [seed] * len(list_nums), filenames, [ajt] * len(list_nums)):
+            instrument.merge(profile)
+            written.append(filename)
+    return written
+
+def load_inputs(items_file: str, assignment_file: Optional[str],
+                translations_file: str) -> Tuple[Optional[pd.DataFrame], pd.DataFrame, Lexicon]:
+    """Load the items, assignment matrix and translations, returning (assignments, items, lexicon).
+
+    assignments is None when no assignment_file is given, for callers that generate the design themselves.
+    """
+    # Item words come from the interned item store, as categorical columns over its vocabulary
+    with instrument.stage('load_items'):
+        store = load_items(items_file)
+    items = store.frame()
+    logger.info(f"Loaded {len(store)} items with {len(store.words)} distinct words from {items_file}")
+    assignments = load_csv(assignment_file) if assignment_file is not None else None
+    translations = load_csv(translations_file)
+
+    # Prepare translations DataFrame
+    translations.set_index(translations.columns[0], inplace=True)  # Set English words as index
+    logger.debug("Translations DataFrame index: %s...", translations.index[:5].tolist())  # Show first 5 index items
+    with instrument.stage('lexicon'):
+        lexicon = Lexicon(translations, store.words)
+    return assignments, items, lexicon
+
 def main():
+    parser = argparse.ArgumentParser(description="Generate the stimulus list files.")
+    parser.add_argument('--seed', type=int, default=None, help="master seed for reproducible lists")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--ajt', action='store_true', help="write AJT workbooks directly instead of stimulus lists")
+    parser.add_argument('--lists', type=int, default=None,
+                        help="generate a Latin-square assignment with this many lists instead of reading item_assignment.csv")
+    parser.add_argument('--blocked', action='store_true', help="with --lists, block each list by language")
+    parser.add_argument('--debug', action='store_true', help="log debug messages as well as progress")
+    parser.add_argument('--profile', default=None,
+                        help="record stage timings and counters and write them to this JSON/Chrome trace file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.profile:
+        instrument.enable()
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    logger.info(f"Using master seed {seed}")
+
     try:
-        # Load CSVs
-        items = load_csv('items.csv')
-        assignments = load_csv('item_assignment.csv')
-        translations = load_csv('translations.csv')
-        
-        # Prepare translations DataFrame
-        translations.set_index(translations.columns[0], inplace=True)  # Set English words as index
-        logger.debug(f"Translations DataFrame index: {translations.index.tolist()[:5]}...")  # Show first 5 index items
-        
-        # Generate stimuli for each list
-        for list_num in assignments.columns[1:]:
-            logger.info(f"Generating stimuli for List {list_num}")
-            stimuli = []
-            
-            # Reset character counter for each list
-            global character_counter
-            character_counter = Counter()
-            
-            for _, row in assignments.iterrows():
-                try:
-                    item_num = row['Item:']
-                    condition = row[list_num]
-                    
-                    # Use the index to access the item, assuming item numbers start from 1
-                    item = items.iloc[item_num - 1]
-                    
-                    stimulus = generate_stimulus(item, condition, translations)
-                    stimuli.append((item_num, condition, stimulus))
-                except Exception as e:
-                    logger.error(f"Error generating stimulus for item {item_num} in List {list_num}: {str(e)}")
-                    logger.debug(f"Item data: {item.to_dict() if 'item' in locals() else 'Item not found'}")
-            
-            # Create Excel file
-            output_filename = f'stimuli_list_{list_num}.xlsx'
-            create_excel_file(stimuli, output_filename)
+        assignment_file = None if args.lists else 'item_assignment.csv'
+        assignments, items, lexicon = load_inputs('items.csv', assignment_file, 'translations.csv')
+        if args.lists:
+            # The design is handed to the list generation in memory; no assignment file is written
+            assignments = build_assignments(len(items), args.lists, blocked=args.blocked)
+            logger.info(f"Generated a Latin-square assignment of {len(items)} items to {args.lists} lists")
+
+        # Generate stimuli for each list in parallel
+        generate_all_lists(assignments, items, lexicon, seed, processes=args.processes, ajt=args.ajt)
     
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
         logger.debug("DataFrame information:")
-        logger.debug(f"Items DataFrame shape: {items.shape if 'items' in locals() else 'Not loaded'}")
-        logger.debug(f"Assignments DataFrame shape: {assignments.shape if 'assignments' in locals() else 'Not loaded'}")
-        logger.debug(f"Translations DataFrame shape: {translations.shape if 'translations' in locals() else 'Not loaded'}")
+        logger.debug("Items DataFrame shape: %s", items.shape if 'items' in locals() else 'Not loaded')
+        logger.debug("Assignments DataFrame shape: %s", assignments.shape if 'assignments' in locals() else 'Not loaded')
+
+    if args.profile:
+        instrument.write_profile(args.profile)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
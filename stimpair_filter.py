@@ -1,42 +1,110 @@
+import argparse
+import os
+import numpy as np
 import pandas as pd
+from surprisal import SurprisalScorer
+import instrument
 
-def process_file(input_file, output_file):
-    # Read the CSV file
-    df = pd.read_csv(input_file)
-    
-    # Print column names
-    print("Columns in the DataFrame:")
-    print(df.columns)
-    
-    # Ask for the correct column name
-    surprisal_column = input("Please enter the exact name of the column containing surprisal values: ")
-    
-    # Create a new empty list to store the results
-    result_list = []
-    
-    # Process pairs of sentences
-    for i in range(0, len(df), 2):
-        pair = df.iloc[i:i+2]
-        
-        # Keep the sentence with lower surprisal
-        kept_sentence = pair.loc[pair[surprisal_column].idxmin()]
-        
-        # Add the kept sentence to the result list
-        result_list.append(kept_sentence)
-    
-    # Create a new DataFrame from the result list
-    result_df = pd.DataFrame(result_list)
-    
-    # Write the result to a new CSV file
-    result_df.to_csv(output_file, index=False)
-    
+def select_pairs(df, surprisal_column):
+    """Keep the sentence with lower surprisal from each consecutive pair of rows."""
+    if len(df) % 2 != 0:
+        raise ValueError(f"Expected sentence pairs, but the input has an odd number of rows ({len(df)})")
+
+    # Missing values never win a pair; on ties the first sentence is kept, as with idxmin
+    surprisal = df[surprisal_column].to_numpy(dtype=float)
+    surprisal = np.where(np.isnan(surprisal), np.inf, surprisal).reshape(-1, 2)
+    kept_rows = np.arange(len(surprisal)) * 2 + surprisal.argmin(axis=1)
+    # Always float, so chunks that do and do not contain a missing value write their numbers the same way
+    return df.iloc[kept_rows].astype({surprisal_column: float})
+
+def check_column(columns, surprisal_column):
+    if surprisal_column not in columns:
+        raise KeyError(f"Column '{surprisal_column}' not found; available columns: {list(columns)}")
+
+def process_file(input_file, output_file, surprisal_column, chunksize=None, corpus_file=None, sentence_column=None,
+                 cache_file='surprisal_cache.sqlite'):
+    """Filter a CSV of sentence pairs down to the lower-surprisal sentence of each pair.
+
+    With chunksize set, the input is streamed in chunks of that many rows (rounded up to keep pairs together)
+    instead of being loaded at once. The output is written to a temporary file and only moved into place once
+    the whole input has been processed.
+
+    With corpus_file set, surprisal_column is filled in by the local n-gram scorer (see surprisal.py) from the
+    sentences in sentence_column, reusing cached scores for sentences seen before.
+    """
+    # One scorer for the whole file, so the chunks share its corpus hash, cache connection and model
+    scorer = SurprisalScorer(corpus_file, cache_file=cache_file) if corpus_file is not None else None
+
+    def read(df):
+        if scorer is not None:
+            with instrument.stage('score_sentences'):
+                df[surprisal_column] = scorer.score(df[sentence_column].astype(str).tolist())
+        return df
+
+    tmp_file = output_file + '.tmp'
+    original_count = 0
+    processed_count = 0
+    try:
+        if chunksize is None:
+            with instrument.stage('read_csv'):
+                df = read(pd.read_csv(input_file))
+            check_column(df.columns, surprisal_column)
+            with instrument.stage('select_pairs'):
+                result_df = select_pairs(df, surprisal_column)
+            with instrument.stage('write_csv'):
+                result_df.to_csv(tmp_file, index=False)
+            original_count, processed_count = len(df), len(result_df)
+        else:
+            chunksize += chunksize % 2
+            with pd.read_csv(input_file, chunksize=chunksize) as reader:
+                for i, chunk in enumerate(reader):
+                    chunk = read(chunk)
+                    if i == 0:
+                        check_column(chunk.columns, surprisal_column)
+                    if len(chunk) % 2 != 0:
+                        # Only the last chunk can be short, so the whole input has an odd row count
+                        raise ValueError(f"Expected sentence pairs, but the input has an odd number of rows "
+                                         f"({original_count + len(chunk)})")
+                    with instrument.stage('select_pairs'):
+                        result_df = select_pairs(chunk, surprisal_column)
+                    with instrument.stage('write_csv'):
+                        result_df.to_csv(tmp_file, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+                    original_count += len(chunk)
+                    processed_count += len(result_df)
+        os.replace(tmp_file, output_file)
+    finally:
+        if scorer is not None:
+            scorer.close()
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    instrument.count('rows_read', original_count)
+    instrument.count('rows_kept', processed_count)
     print(f"Processed file saved as {output_file}")
-    print(f"Original sentence count: {len(df)}")
-    print(f"Processed sentence count: {len(result_df)}")
+    print(f"Original sentence count: {original_count}")
+    print(f"Processed sentence count: {processed_count}")
 
 # Main execution
 if __name__ == "__main__":
-    input_file = "paired_sentences.csv"  # Change this to your input file name
-    output_file = "filtered_roberta.csv"  # Change this to your desired output file name
-    
-    process_file(input_file, output_file)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Keep the lower-surprisal sentence of each consecutive pair.")
+    parser.add_argument('input_file', nargs='?', default="paired_sentences.csv")
+    parser.add_argument('output_file', nargs='?', default="filtered_roberta.csv")
+    parser.add_argument('--column', required=True, help="name of the column containing surprisal values")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="stream the input in chunks of this many rows instead of loading it at once")
+    parser.add_argument('--corpus', default=None,
+                        help="compute --column with the local n-gram scorer trained on this corpus file")
+    parser.add_argument('--sentence-column', default=None, help="column holding the sentences to score with --corpus")
+    parser.add_argument('--cache', default='surprisal_cache.sqlite', help="persistent score cache for --corpus")
+    parser.add_argument('--profile', default=None,
+                        help="record stage timings and counters and write them to this JSON/Chrome trace file")
+    args = parser.parse_args()
+    if args.corpus and not args.sentence_column:
+        parser.error("--corpus requires --sentence-column")
+    if args.profile:
+        instrument.enable()
+
+    process_file(args.input_file, args.output_file, args.column, chunksize=args.chunksize, corpus_file=args.corpus,
+                 sentence_column=args.sentence_column, cache_file=args.cache)
+    if args.profile:
+        instrument.write_profile(args.profile)
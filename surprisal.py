@@ -0,0 +1,166 @@
+import argparse
+import hashlib
+import math
+import re
+import sqlite3
+from collections import Counter
+
+import pandas as pd
+
+import instrument
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def tokenize(sentence):
+    return TOKEN_PATTERN.findall(sentence.lower())
+
+class NgramModel:
+    """Interpolated n-gram language model trained on a local corpus, one sentence per line.
+
+    P(w | history) mixes the maximum-likelihood estimates for each history length with an add-one unigram,
+    so unseen words and histories still get a finite surprisal.
+    """
+
+    def __init__(self, sentences, order=3, weights=None):
+        self.order = order
+        if weights is None:
+            # A unigram model has nothing to interpolate with, so its estimate takes the whole weight
+            weights = [1.0] if order == 1 else [0.1] + [0.9 * 2 ** k / (2 ** (order - 1) - 1) for k in range(order - 1)]
+        self.weights = weights
+        self.counts = [Counter() for _ in range(order)]  # counts[n]: (n+1)-grams
+        self.context_counts = [Counter() for _ in range(order)]  # context_counts[n]: n-word histories
+        for sentence in sentences:
+            tokens = ['<s>'] * (order - 1) + tokenize(sentence) + ['</s>']
+            for i in range(order - 1, len(tokens)):
+                for n in range(order):
+                    self.counts[n][tuple(tokens[i - n:i + 1])] += 1
+                    self.context_counts[n][tuple(tokens[i - n:i])] += 1
+        self.vocabulary_size = len(self.counts[0]) + 1  # one slot for unknown words
+        self.total_tokens = sum(self.counts[0].values())
+
+    @classmethod
+    def from_file(cls, corpus_file, order=3):
+        with open(corpus_file, 'r', encoding='utf-8') as f:
+            return cls((line for line in f if line.strip()), order=order)
+
+    def probability(self, history, word):
+        probability = self.weights[0] * (self.counts[0][(word,)] + 1) / (self.total_tokens + self.vocabulary_size)
+        unused = 0.0
+        for n in range(1, self.order):
+            context = tuple(history[len(history) - n:])
+            context_count = self.context_counts[n][context]
+            if context_count:
+                probability += self.weights[n] * self.counts[n][context + (word,)] / context_count
+            else:
+                unused += self.weights[n]
+        # Weight of unseen histories goes to the unigram estimate so the mixture still sums to one
+        return probability + unused * (self.counts[0][(word,)] + 1) / (self.total_tokens + self.vocabulary_size)
+
+    def surprisal(self, sentence):
+        """Total surprisal of a sentence in bits, including the end-of-sentence token."""
+        tokens = ['<s>'] * (self.order - 1) + tokenize(sentence) + ['</s>']
+        return sum(-math.log2(self.probability(tokens[i - self.order + 1:i], tokens[i]))
+                   for i in range(self.order - 1, len(tokens)))
+
+def model_id(corpus_file, order):
+    """Fingerprint of the corpus contents and model order, so a changed corpus never reuses old scores."""
+    digest = hashlib.sha256(f"order={order}\n".encode())
+    with open(corpus_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class SurprisalCache:
+    """Persistent SQLite cache of sentence surprisal, keyed by model fingerprint and sentence text."""
+
+    def __init__(self, cache_file):
+        self.connection = sqlite3.connect(cache_file)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS surprisal "
+                                "(model TEXT, sentence TEXT, value REAL, PRIMARY KEY (model, sentence))")
+
+    def get_many(self, model, sentences):
+        found = {}
+        for start in range(0, len(sentences), 500):
+            batch = sentences[start:start + 500]
+            query = f"SELECT sentence, value FROM surprisal WHERE model = ? AND sentence IN ({','.join('?' * len(batch))})"
+            found.update(self.connection.execute(query, [model, *batch]))
+        return found
+
+    def put_many(self, model, values):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO surprisal VALUES (?, ?, ?)",
+                                        [(model, sentence, value) for sentence, value in values.items()])
+
+    def close(self):
+        self.connection.close()
+
+class SurprisalScorer:
+    """Scores batches of sentences against one corpus, sharing the fingerprint, cache and model across calls.
+
+    Each of these is built on first use and then kept, so a file scored chunk by chunk hashes the corpus,
+    opens the cache and trains the model at most once; the model is trained only when some sentence is
+    missing from the cache.
+    """
+
+    def __init__(self, corpus_file, cache_file='surprisal_cache.sqlite', order=3, batch_size=1000):
+        self.corpus_file = corpus_file
+        self.cache_file = cache_file
+        self.order = order
+        self.batch_size = batch_size
+        self._model_key = None
+        self._cache = None
+        self._model = None
+
+    def score(self, sentences):
+        """Return the surprisal of each sentence, computing only sentences missing from the cache."""
+        if self._model_key is None:
+            self._model_key = model_id(self.corpus_file, self.order)
+            self._cache = SurprisalCache(self.cache_file)
+        unique = list(dict.fromkeys(sentences))
+        scores = self._cache.get_many(self._model_key, unique)
+        missing = [sentence for sentence in unique if sentence not in scores]
+        if missing and self._model is None:
+            self._model = NgramModel.from_file(self.corpus_file, order=self.order)
+        for start in range(0, len(missing), self.batch_size):
+            batch = {sentence: self._model.surprisal(sentence) for sentence in missing[start:start + self.batch_size]}
+            self._cache.put_many(self._model_key, batch)
+            scores.update(batch)
+        instrument.count('surprisal_cache_hits', len(unique) - len(missing))
+        instrument.count('surprisal_cache_misses', len(missing))
+        print(f"Scored {len(missing)} new sentences ({len(unique) - len(missing)} from cache)")
+        return [scores[sentence] for sentence in sentences]
+
+    def close(self):
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+
+def score_sentences(sentences, corpus_file, cache_file='surprisal_cache.sqlite', order=3, batch_size=1000):
+    """Return the surprisal of each sentence, computing only sentences missing from the cache."""
+    scorer = SurprisalScorer(corpus_file, cache_file=cache_file, order=order, batch_size=batch_size)
+    try:
+        return scorer.score(sentences)
+    finally:
+        scorer.close()
+
+def score_file(input_file, output_file, sentence_column, corpus_file, surprisal_column='surprisal',
+               cache_file='surprisal_cache.sqlite', order=3):
+    """Add a surprisal column to a CSV of sentences, ready for stimpair_filter.process_file."""
+    df = pd.read_csv(input_file)
+    df[surprisal_column] = score_sentences(df[sentence_column].astype(str).tolist(), corpus_file,
+                                           cache_file=cache_file, order=order)
+    df.to_csv(output_file, index=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score sentences with a local n-gram model.")
+    parser.add_argument('input_file')
+    parser.add_argument('output_file')
+    parser.add_argument('--sentence-column', required=True, help="column holding the sentences")
+    parser.add_argument('--corpus', required=True, help="training corpus, one sentence per line")
+    parser.add_argument('--column', default='surprisal', help="name of the surprisal column to add")
+    parser.add_argument('--cache', default='surprisal_cache.sqlite', help="persistent score cache")
+    parser.add_argument('--order', type=int, default=3, help="n-gram order")
+    args = parser.parse_args()
+
+    score_file(args.input_file, args.output_file, args.sentence_column, args.corpus, surprisal_column=args.column,
+               cache_file=args.cache, order=args.order)
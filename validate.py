@@ -0,0 +1,179 @@
+import argparse
+import glob
+import os
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from ajtconvert import PRONOUNS, WORD_COLUMNS, list_name
+from itemstore import load_items
+from stimgen import CHARACTERS, CONDITION_PRONOUNS, PLURAL_CONDITIONS, SUBJECTS, character_pairs, load_inputs
+
+MAX_TOKENS = len(WORD_COLUMNS)  # ajtconvert truncates longer stimuli
+REPORT_COLUMNS = ['List', 'Item Number', 'Condition Number', 'check', 'detail']
+
+# (condition, pronoun) pairs a stimulus may use
+ALLOWED_PRONOUNS = pd.MultiIndex.from_tuples(
+    [(condition, pronoun) for table in CONDITION_PRONOUNS.values() for condition, options in table.items()
+     for pronoun in (options if isinstance(options, list) else [options])])
+
+def load_lists(patterns=('stimuli_list_*.xlsx',)):
+    """Read every matching stimulus list into one frame with a List column."""
+    files = sorted({f for pattern in patterns for f in glob.glob(pattern)})
+    readers = {'.xlsx': pd.read_excel, '.csv': pd.read_csv, '.parquet': pd.read_parquet}
+    frames = [readers[os.path.splitext(f)[1].lower()](f).assign(List=list_name(f)) for f in files]
+    if not frames:
+        return pd.DataFrame(columns=['List', 'Item Number', 'Condition Number', 'Stimulus'])
+    return pd.concat(frames, ignore_index=True)
+
+def tokenize(stimuli):
+    """Split stimuli into an (rows, max tokens) object array padded with '', using ajtconvert's \\w+ tokens."""
+    # object dtype keeps \w Unicode-aware (on the pyarrow string dtype it matches ASCII only)
+    tokens = stimuli.astype(str).astype(object).str.findall(r'\b\w+\b').tolist()
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    split = np.full((len(tokens), max(lengths.max(initial=0), 1)), '', dtype=object)
+    rows = np.repeat(np.arange(len(tokens)), lengths)
+    positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    split[rows, positions] = np.fromiter(chain.from_iterable(tokens), dtype=object, count=lengths.sum())
+    return split
+
+def form_table(lexicon, verbs):
+    """Map each (language, plural) form class to the first tokens its verb forms may start with."""
+    tables = {('French', False): lexicon.french, ('French', True): lexicon.french_plural,
+              ('English', False): lexicon.english_singular, ('English', True): lexicon.english_base}
+    return pd.MultiIndex.from_tuples(sorted({(language, plural, table[verb].split()[0])
+                                             for (language, plural), table in tables.items()
+                                             for verb in verbs if table.get(verb)}))
+
+def check_lexicon(lexicon, verbs):
+    """Flag lexicon entries that would put a wrong form into every stimulus using them.
+
+    Item verbs are written in the third person singular, so conjugating one back to the singular must give the
+    word itself; a mismatch (e.g. "writes" -> "writs") means get_base_form or conjugate_english got it wrong.
+    """
+    problems = []
+    for verb in sorted(verbs):
+        singular = lexicon.english_verb(verb, True)
+        if singular != verb:
+            problems.append(('', None, None, 'english_conjugation', f"{verb} -> {singular} / {lexicon.english_verb(verb, False)}"))
+    for word in sorted(lexicon.missing):
+        problems.append(('', None, None, 'missing_translation', word))
+    return problems
+
+def check_pair_balance(df, first, third, plural):
+    """Within each list and plural condition, every character pair must be used equally often (to within one)."""
+    if not plural.any():
+        return []
+    first, third = first[plural], third[plural]
+    pairs = np.where(first < third, first + '+' + third, third + '+' + first)
+    names = ['+'.join(sorted(pair)) for pair in character_pairs(CHARACTERS)]
+    counts = (pd.DataFrame({'List': df['List'].to_numpy()[plural], 'Condition Number': df['Condition Number'].to_numpy()[plural],
+                            'pair': pairs})
+              .value_counts().unstack('pair', fill_value=0).reindex(columns=names, fill_value=0))
+    unbalanced = counts[counts.max(axis=1) - counts.min(axis=1) > 1]
+    return [(list_num, None, int(condition), 'pair_balance', ', '.join(f"{pair} {n}" for pair, n in row.items()))
+            for (list_num, condition), row in unbalanced.iterrows()]
+
+def validate_frame(df, lexicon, verbs):
+    """Check every stimulus row at once and return the violations as a frame with REPORT_COLUMNS."""
+    df = df.reset_index(drop=True)
+    n = len(df)
+    rows = np.arange(n)
+    conditions = df['Condition Number'].to_numpy(dtype=np.int64)
+    tokens = tokenize(df['Stimulus'])
+    width = tokens.shape[1]
+    if width < 3:
+        tokens = np.hstack([tokens, np.full((n, 3 - width), '', dtype=object)])
+        width = 3
+    counts = (tokens != '').sum(axis=1)
+
+    french = conditions <= 8
+    plural = np.isin(conditions, PLURAL_CONDITIONS)
+    subject_length = np.where(plural, 3, 1)
+    checks = {}
+
+    checks['token_count'] = (counts > MAX_TOKENS, lambda i: f"{counts[i]} tokens")
+
+    # Pronouns: exactly one, of the condition's language and referent, with room for verb1 + connector and verb2
+    lower = pd.DataFrame(tokens).apply(lambda column: column.str.lower())
+    is_pronoun = lower.isin(PRONOUNS).to_numpy()
+    pronoun_count = is_pronoun.sum(axis=1)
+    position = is_pronoun.argmax(axis=1)
+    pronoun = lower.to_numpy()[rows, position]
+    checks['pronoun_count'] = (pronoun_count != 1, lambda i: f"{pronoun_count[i]} pronouns")
+    has_pronoun = pronoun_count >= 1
+    consistent = pd.MultiIndex.from_arrays([conditions, pronoun]).isin(ALLOWED_PRONOUNS)
+    checks['pronoun_condition'] = (has_pronoun & ~consistent, lambda i: f"'{pronoun[i]}' in condition {conditions[i]}")
+    misplaced = has_pronoun & ((position < subject_length + 2) | (position > counts - 2))
+    checks['pronoun_position'] = (misplaced, lambda i: f"pronoun at token {position[i] + 1} of {counts[i]}")
+
+    # Subject: the condition's character, or two different characters joined by the language's "and"
+    first, second, third = tokens[:, 0], tokens[:, 1], tokens[:, 2]
+    expected_subject = pd.Series(conditions).map(SUBJECTS).to_numpy(dtype=object)
+    conjunction = np.where(french, 'et', 'and')
+    bad_plural = ~(np.isin(first, CHARACTERS) & np.isin(third, CHARACTERS) & (first != third) & (second == conjunction))
+    bad_subject = np.where(plural, bad_plural, first != expected_subject)
+    checks['subject'] = (bad_subject, lambda i: ' '.join(tokens[i, :subject_length[i]]))
+
+    # Agreement: verb1 agrees with the subject; verb2 with the subject in French and with the pronoun in English
+    forms = form_table(lexicon, verbs)
+    language = np.where(french, 'French', 'English')
+    verb1 = tokens[rows, np.minimum(subject_length, width - 1)]
+    verb2 = tokens[rows, np.minimum(position + 1, width - 1)]
+    verb2_plural = plural | (conditions == 13)
+    for name, verb, number in (('verb1_agreement', verb1, plural), ('verb2_agreement', verb2, verb2_plural)):
+        agrees = pd.MultiIndex.from_arrays([language, number, verb]).isin(forms)
+        checks[name] = (~agrees & (verb != ''), lambda i, verb=verb, number=number:
+                        f"'{verb[i]}' is not a {'plural' if number[i] else 'singular'} {language[i]} verb form")
+
+    violations = []
+    for check, (mask, describe) in checks.items():
+        for i in np.flatnonzero(mask):
+            violations.append((df.at[i, 'List'], int(df.at[i, 'Item Number']), int(conditions[i]), check, describe(i)))
+    violations += check_pair_balance(df, first, third, plural)
+    return violations
+
+def validate(stimuli, lexicon, verbs):
+    """Validate a frame of stimulus rows (with List, Item Number, Condition Number, Stimulus) plus the lexicon."""
+    violations = check_lexicon(lexicon, verbs) + validate_frame(stimuli, lexicon, verbs)
+    return pd.DataFrame(violations, columns=REPORT_COLUMNS).astype({'Item Number': 'Int64', 'Condition Number': 'Int64'})
+
+def item_verbs(items_file):
+    store = load_items(items_file)
+    return {store.words[word_id] for word_id in set(store.verb1) | set(store.verb2)}
+
+def print_report(report, num_rows, examples=3):
+    if report.empty:
+        print(f"All {num_rows} stimuli passed validation")
+        return
+    print(f"{len(report)} violations in {num_rows} stimuli:")
+    for check, group in report.groupby('check', sort=False):
+        print(f"  {check}: {len(group)}")
+        for list_num, item, condition, _, detail in group.head(examples).itertuples(index=False):
+            where = [f"{name} {value}" for name, value in (('List', list_num), ('item', item), ('condition', condition))
+                     if pd.notna(value) and value != '']
+            print(f"    {', '.join(where) + ': ' if where else ''}{detail}")
+
+def validate_files(patterns, items_file, translations_file, report_file=None):
+    """Validate every matching stimulus list in one batch; returns the violation report."""
+    _, _, lexicon = load_inputs(items_file, None, translations_file)
+    stimuli = load_lists(patterns)
+    report = validate(stimuli, lexicon, item_verbs(items_file))
+    print_report(report, len(stimuli))
+    if report_file:
+        report.to_csv(report_file, index=False)
+        print(f"Report written to {report_file}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate generated stimulus lists.")
+    parser.add_argument('patterns', nargs='*', default=['stimuli_list_*.xlsx'],
+                        help="stimulus list files or glob patterns (default: stimuli_list_*.xlsx)")
+    parser.add_argument('--items', default='items.csv', help="items the lists were generated from")
+    parser.add_argument('--translations', default='translations.csv', help="translation table")
+    parser.add_argument('--report', default=None, help="write the violations to this CSV file")
+    args = parser.parse_args()
+
+    report = validate_files(args.patterns, args.items, args.translations, report_file=args.report)
+    raise SystemExit(1 if len(report) else 0)